@@ -3,11 +3,14 @@ import json
 import signal
 import time
 import html
+import heapq
+import hashlib
 import asyncio
 import contextlib
 import traceback
 import random
 import asyncpg
+from collections import defaultdict
 from datetime import datetime, date, timedelta, timezone
 from zoneinfo import ZoneInfo
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
@@ -16,15 +19,23 @@ from telegram.error import BadRequest, Conflict
 
 from config import (
     ALLOWED_USERNAMES,
+    COMPACT_DATA_CACHE_TTL_SEC,
     DATABASE_URL,
+    DB_POOL_MAX_SIZE,
     LETTERS,
+    MAX_IN_MEMORY_SESSIONS,
     ONBOARDING_STEPS,
     OWNER_USERNAME,
     PAUSED_SESSION_TTL_HOURS,
     QUIZ_GENERATION_TIMEOUT_SEC,
+    QUIZ_PREFETCH_ACTIVE_DAYS,
+    QUIZ_PREFETCH_ENABLED,
+    QUIZ_PREFETCH_LOCAL_HOUR,
     QUIZ_QUESTION_COUNT,
     STATE_ONBOARDING,
     STATE_SETTINGS_EDIT,
+    TELEGRAM_POOL_SIZE,
+    TELEGRAM_POOL_TIMEOUT_SEC,
     TG_TOKEN,
     WELCOME_TEXT,
 )
@@ -37,7 +48,14 @@ MAIN_MENU_KEYBOARD = [
 ]
 
 from topics import MASTER_TOPICS, build_topic_sequence
-from quiz_generation import TYPE_LABELS, TYPE_NAMES_RU, generate_questions
+from quiz_generation import (
+    PROMPT_DIGEST,
+    TYPE_LABELS,
+    TYPE_NAMES_RU,
+    close_openai_client,
+    generate_questions,
+    shuffle_options,
+)
 
 
 db_pool = None
@@ -68,20 +86,44 @@ def get_main_menu_keyboard(user) -> list[list[InlineKeyboardButton]]:
 def h(text):
     return html.escape(str(text))
 
+
+# Topic and question-type names come from fixed tables, so their escaped form is computed once.
+_TOPIC_HTML = {t: h(t) for t in MASTER_TOPICS}
+_TYPE_NAME_HTML = {qt: h(name) for qt, name in TYPE_NAMES_RU.items()}
+# /stats lists at most this many never-practiced topics by name.
+_UNSEEN_TOPICS_SHOWN = 20
+# Accuracy marker indexed by a 0-100 percentage (same 60 / 85 thresholds as the buckets).
+_ACCURACY_BAR = tuple("🔴" if p < 60 else "🟡" if p < 85 else "🟢" for p in range(101))
+
+
+def h_topic(topic):
+    return _TOPIC_HTML.get(topic) or h(topic)
+
 # ─── Database (Railway PostgreSQL) ─────────────────────────────────────────────
 #
-# FOUR tables:
+# Core tables:
 #   users        — registered Telegram users
-#   quiz_sessions — one row per completed quiz
-#   answers      — raw audit log: topic, type, correct per question
+#   quiz_sessions — one row per completed quiz, with its answers as a JSONB array
+#                  (topic, type, correct per question)
+#   answers      — legacy per-answer rows; no longer written, backfilled into
+#                  quiz_sessions.answers on startup
 #   topic_stats  — per-topic all-time aggregates (upserted after each quiz)
+#   type_stats   — per-question-type all-time aggregates (upserted after each quiz)
 #
 # build_prompt() uses topic_stats + quiz_sessions only → token cost is O(topics).
-# answers is kept for /stats display and future analysis.
+# quiz_sessions.answers is kept for future analysis; /stats reads the aggregates.
 
 async def init_db():
     global db_pool
-    db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
+    # Updates are processed concurrently, so size the pool for several in-flight handlers.
+    # JIT is disabled in the startup packet: every query here is a tiny indexed lookup
+    # for which LLVM compilation only adds latency.
+    db_pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=1,
+        max_size=DB_POOL_MAX_SIZE,
+        server_settings={"jit": "off"},
+    )
     async with db_pool.acquire() as conn:
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -136,6 +178,22 @@ async def init_db():
                 correct       BOOLEAN      NOT NULL
             )
         """)
+        # Serves the backfill below and the ON DELETE CASCADE of legacy answer rows.
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_session ON answers (session_id)")
+        # One JSONB write per quiz instead of ~20 answer rows. Backfill sessions saved
+        # before the column existed (no-op once every row has it).
+        await conn.execute("ALTER TABLE quiz_sessions ADD COLUMN IF NOT EXISTS answers JSONB")
+        await conn.execute("""
+            UPDATE quiz_sessions qs
+            SET answers = COALESCE((
+                SELECT jsonb_agg(
+                    jsonb_build_object('topic', a.topic, 'type', a.question_type, 'correct', a.correct)
+                    ORDER BY a.id
+                )
+                FROM answers a WHERE a.session_id = qs.id
+            ), '[]'::jsonb)
+            WHERE qs.answers IS NULL
+        """)
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS topic_stats (
                 user_id   BIGINT REFERENCES users(telegram_id) ON DELETE CASCADE,
@@ -146,6 +204,30 @@ async def init_db():
                 PRIMARY KEY (user_id, topic)
             )
         """)
+        # /stats per-type accuracy, kept incrementally like topic_stats so it never has
+        # to aggregate the whole answer history. Filled from quiz_sessions.answers once,
+        # when the table is first created.
+        async with conn.transaction():
+            type_stats_existed = await conn.fetchval("SELECT to_regclass('type_stats') IS NOT NULL")
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS type_stats (
+                    user_id       BIGINT REFERENCES users(telegram_id) ON DELETE CASCADE,
+                    question_type VARCHAR(20) NOT NULL,
+                    correct       INT DEFAULT 0,
+                    total         INT DEFAULT 0,
+                    PRIMARY KEY (user_id, question_type)
+                )
+            """)
+            if not type_stats_existed:
+                await conn.execute("""
+                    INSERT INTO type_stats (user_id, question_type, correct, total)
+                    SELECT qs.user_id, a->>'type',
+                           COUNT(*) FILTER (WHERE (a->>'correct')::boolean),
+                           COUNT(*)
+                    FROM quiz_sessions qs, jsonb_array_elements(qs.answers) a
+                    WHERE qs.user_id IS NOT NULL AND a->>'type' <> ''
+                    GROUP BY 1, 2
+                """)
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS paused_sessions (
                 user_id       BIGINT PRIMARY KEY REFERENCES users(telegram_id) ON DELETE CASCADE,
@@ -157,6 +239,14 @@ async def init_db():
                 expires_at    TIMESTAMPTZ NOT NULL
             )
         """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS prefetched_quizzes (
+                user_id    BIGINT PRIMARY KEY REFERENCES users(telegram_id) ON DELETE CASCADE,
+                questions  JSONB NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+        await conn.execute("ALTER TABLE prefetched_quizzes ADD COLUMN IF NOT EXISTS fingerprint TEXT NOT NULL DEFAULT ''")
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS topic_memory (
                 user_id      BIGINT REFERENCES users(telegram_id) ON DELETE CASCADE,
@@ -189,6 +279,15 @@ async def init_db():
                 PRIMARY KEY (user_id, reminder_date)
             )
         """)
+        # Every hot query filters by user_id; without these, quiz_sessions is seq-scanned
+        # as history grows.
+        await conn.execute("DROP INDEX IF EXISTS idx_answers_user_type")
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_quiz_sessions_user_date ON quiz_sessions (user_id, session_date)"
+        )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_quiz_sessions_user_completed ON quiz_sessions (user_id, completed_at)"
+        )
 
 
 def _safe_zoneinfo(tz_name: str | None) -> ZoneInfo:
@@ -290,6 +389,8 @@ async def _save_profile(user_id: int, data: dict):
                 "UPDATE users SET onboarding_complete = TRUE WHERE telegram_id = $1",
                 user_id,
             )
+            await conn.execute("DELETE FROM prefetched_quizzes WHERE user_id = $1", user_id)
+    _stats_text_cache.pop(user_id, None)
 
 
 async def _update_profile_field(user_id: int, field: str, value: str):
@@ -323,10 +424,13 @@ async def _update_profile_field(user_id: int, field: str, value: str):
         val = value
 
     async with _acquire() as conn:
-        await conn.execute(
-            f"UPDATE user_profiles SET {col} = $1, updated_at = NOW() WHERE user_id = $2",
-            val, user_id,
-        )
+        async with conn.transaction():
+            await conn.execute(
+                f"UPDATE user_profiles SET {col} = $1, updated_at = NOW() WHERE user_id = $2",
+                val, user_id,
+            )
+            await conn.execute("DELETE FROM prefetched_quizzes WHERE user_id = $1", user_id)
+    _stats_text_cache.pop(user_id, None)
 
 
 async def _reset_profile(user_id: int):
@@ -338,6 +442,24 @@ async def _reset_profile(user_id: int):
                 "UPDATE users SET onboarding_complete = FALSE WHERE telegram_id = $1",
                 user_id,
             )
+    _stats_text_cache.pop(user_id, None)
+
+
+# user_id -> (fetched_at, stats, session_dates). Both /quiz and /stats start with
+# _load_compact_data; repeated opens within the TTL skip the DB entirely. Entries are
+# dropped whenever the user's statistics change (save_result / clear_history).
+_compact_cache = {}
+
+# user_id -> ((total_sessions, day), rendered /stats text). Re-opening /stats without
+# a new quiz in between re-sends the same text; dropped together with _compact_cache
+# and on profile edits (the exam countdown comes from the profile).
+_stats_text_cache = {}
+
+
+def _invalidate_compact_cache(user_id: int) -> None:
+    _compact_cache.pop(user_id, None)
+    _stats_text_cache.pop(user_id, None)
+    _streak_cache.pop(user_id, None)
 
 
 async def _load_compact_data(user_id: int):
@@ -346,26 +468,39 @@ async def _load_compact_data(user_id: int):
     Returns:
       stats        — {topic: {correct, total, last_seen}}
       session_dates — sorted list of YYYY-MM-DD strings
+    Results are shared through a short-lived cache, so callers must not mutate them.
     """
+    await _wait_for_pending_save(user_id)
+    cached = _compact_cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < COMPACT_DATA_CACHE_TTL_SEC:
+        return cached[1], cached[2]
+
+    # One round-trip: topic_stats rows and distinct session dates in a single UNION ALL,
+    # told apart by which side's columns are NULL.
     async with _acquire() as conn:
-        stats_rows = await conn.fetch(
-            "SELECT topic, correct, total, last_seen FROM topic_stats WHERE user_id=$1",
-            user_id,
-        )
-        date_rows = await conn.fetch(
-            "SELECT DISTINCT session_date FROM quiz_sessions "
-            "WHERE user_id=$1 ORDER BY session_date",
+        rows = await conn.fetch(
+            """
+            SELECT topic, correct, total, last_seen, NULL::date AS session_date
+            FROM topic_stats WHERE user_id=$1
+            UNION ALL
+            SELECT NULL, NULL, NULL, NULL, session_date
+            FROM (SELECT DISTINCT session_date FROM quiz_sessions WHERE user_id=$1) d
+            """,
             user_id,
         )
-    stats = {
-        r["topic"]: {
-            "correct":   r["correct"],
-            "total":     r["total"],
-            "last_seen": str(r["last_seen"]) if r["last_seen"] else "",
-        }
-        for r in stats_rows
-    }
-    session_dates = [str(r["session_date"]) for r in date_rows]
+    stats = {}
+    session_dates = []
+    for r in rows:
+        if r["topic"] is not None:
+            stats[r["topic"]] = {
+                "correct":   r["correct"],
+                "total":     r["total"],
+                "last_seen": str(r["last_seen"]) if r["last_seen"] else "",
+            }
+        else:
+            session_dates.append(str(r["session_date"]))
+    session_dates.sort()
+    _compact_cache[user_id] = (time.monotonic(), stats, session_dates)
     return stats, session_dates
 
 
@@ -390,36 +525,42 @@ async def _load_topic_memory(user_id: int) -> dict:
     }
 
 
-async def _update_topic_memory_for_answer(conn, user_id: int, topic: str, correct: bool) -> None:
-    """Update spaced-repetition state for one topic attempt."""
-    row = await conn.fetchrow(
-        "SELECT mastery, stability, review_count, lapses FROM topic_memory "
-        "WHERE user_id=$1 AND topic=$2",
-        user_id, topic,
-    )
-    if row:
-        mastery = float(row["mastery"])
-        stability = float(row["stability"])
-        review_count = int(row["review_count"])
-        lapses = int(row["lapses"])
-    else:
-        mastery = 0.25
-        stability = 1.0
-        review_count = 0
-        lapses = 0
-
-    if correct:
-        mastery = min(1.0, mastery + 0.08)
-        stability = min(45.0, max(1.0, stability * 1.4))
-    else:
-        mastery = max(0.0, mastery - 0.12)
-        stability = max(1.0, stability * 0.6)
-        lapses += 1
+async def _update_topic_memory(conn, user_id: int, answers: list) -> None:
+    """Update spaced-repetition state for every topic attempted in a quiz.
 
-    review_count += 1
-    due_at = date.today() + timedelta(days=max(1, round(stability)))
+    Reads the current state of all touched topics in one query, replays the
+    answers in order in Python, then writes the final state back in one batch.
+    """
+    topics = list(dict.fromkeys(a["topic"] for a in answers))
+    rows = await conn.fetch(
+        "SELECT topic, mastery, stability, review_count, lapses FROM topic_memory "
+        "WHERE user_id=$1 AND topic = ANY($2::text[])",
+        user_id, topics,
+    )
+    state = {
+        r["topic"]: (float(r["mastery"]), float(r["stability"]), int(r["review_count"]), int(r["lapses"]))
+        for r in rows
+    }
 
-    await conn.execute(
+    for a in answers:
+        mastery, stability, review_count, lapses = state.get(a["topic"], (0.25, 1.0, 0, 0))
+        if a["correct"]:
+            mastery = min(1.0, mastery + 0.08)
+            stability = min(45.0, max(1.0, stability * 1.4))
+        else:
+            mastery = max(0.0, mastery - 0.12)
+            stability = max(1.0, stability * 0.6)
+            lapses += 1
+        review_count += 1
+        state[a["topic"]] = (mastery, stability, review_count, lapses)
+
+    today = date.today()
+    rows = []
+    for topic in topics:
+        mastery, stability, review_count, lapses = state[topic]
+        due_at = today + timedelta(days=max(1, round(stability)))
+        rows.append((user_id, topic, mastery, stability, due_at, review_count, lapses))
+    await conn.executemany(
         """
         INSERT INTO topic_memory (user_id, topic, mastery, stability, due_at, last_seen, review_count, lapses)
         VALUES ($1, $2, $3, $4, $5, CURRENT_DATE, $6, $7)
@@ -431,102 +572,234 @@ async def _update_topic_memory_for_answer(conn, user_id: int, topic: str, correc
             review_count = EXCLUDED.review_count,
             lapses = EXCLUDED.lapses
         """,
-        user_id, topic, mastery, stability, due_at, review_count, lapses,
+        rows,
     )
 
 
-async def _load_history_for_stats(user_id: int):
-    """Load full answers only for /stats display (infrequent). Not used on quiz start."""
+async def _load_type_stats(user_id: int) -> dict | None:
+    """Per question-type accuracy for /stats display (infrequent). Not used on quiz start.
+
+    Read from the type_stats aggregates maintained by _save_all — a handful of rows,
+    independent of how many answers the user has ever given. Returns None if the
+    read failed, so callers can tell "no data" from "not loaded".
+    """
     try:
         async with _acquire() as conn:
             rows = await conn.fetch(
-                "SELECT topic, question_type AS type, correct FROM answers WHERE user_id=$1",
+                "SELECT question_type, correct, total FROM type_stats WHERE user_id=$1",
                 user_id,
             )
-        return [{"topic": r["topic"], "type": r["type"], "correct": r["correct"]} for r in rows]
     except Exception as e:
-        print(f"Load history error: {e}")
-        return []
+        print(f"Load type stats error: {e}")
+        return None
+    return {r["question_type"]: {"correct": r["correct"], "total": r["total"]} for r in rows}
 
 
-async def _save_all(user_id: int, answers: list):
+async def _save_all(conn, user_id: int, answers: list):
     """
-    Persist one quiz session atomically:
-      1. Insert a quiz_sessions row
-      2. Bulk-insert raw answer rows
-      3. Upsert topic_stats (increment correct/total, update last_seen)
+    Persist one quiz session on conn (the caller owns the transaction):
+      1. Insert a quiz_sessions row carrying the answers as JSONB
+      2. Upsert topic_stats (increment correct/total, update last_seen) — one row per topic
+      3. Upsert type_stats (increment correct/total) — one row per question type
+      4. Update topic_memory (spaced-repetition state)
+      5. Drop any prefetched quiz — it was planned from the old stats
     """
+    # Pre-aggregate per topic / type so each table gets one upsert row per key, not per answer.
+    per_topic = {}
+    per_type = {}
+    for a in answers:
+        t = per_topic.setdefault(a["topic"], [0, 0])
+        t[0] += 1 if a["correct"] else 0
+        t[1] += 1
+        if a.get("type"):
+            t = per_type.setdefault(a["type"], [0, 0])
+            t[0] += 1 if a["correct"] else 0
+            t[1] += 1
     upsert_sql = (
         "INSERT INTO topic_stats (user_id, topic, correct, total, last_seen) "
-        "VALUES ($1, $2, $3, 1, CURRENT_DATE) "
+        "VALUES ($1, $2, $3, $4, CURRENT_DATE) "
         "ON CONFLICT (user_id, topic) DO UPDATE SET "
-        "  correct   = topic_stats.correct + $3, "
-        "  total     = topic_stats.total + 1, "
+        "  correct   = topic_stats.correct + EXCLUDED.correct, "
+        "  total     = topic_stats.total + EXCLUDED.total, "
         "  last_seen = CURRENT_DATE"
     )
-    async with _acquire() as conn:
-        async with conn.transaction():
-            correct_count = sum(1 for a in answers if a["correct"])
-            session_id = await conn.fetchval(
-                "INSERT INTO quiz_sessions (user_id, session_date, correct_answers, total_questions) "
-                "VALUES ($1, CURRENT_DATE, $2, $3) RETURNING id",
-                user_id, correct_count, len(answers),
-            )
-            await conn.executemany(
-                "INSERT INTO answers (user_id, session_id, topic, question_type, correct) "
-                "VALUES ($1, $2, $3, $4, $5)",
-                [(user_id, session_id, a["topic"], a["type"], a["correct"]) for a in answers],
-            )
-            for a in answers:
-                await conn.execute(
-                    upsert_sql,
-                    user_id, a["topic"], 1 if a["correct"] else 0,
-                )
-                await _update_topic_memory_for_answer(
-                    conn, user_id, a["topic"], a["correct"],
-                )
+    correct_count = sum(1 for a in answers if a["correct"])
+    await conn.execute(
+        "INSERT INTO quiz_sessions (user_id, session_date, correct_answers, total_questions, answers) "
+        "VALUES ($1, CURRENT_DATE, $2, $3, $4::jsonb)",
+        user_id, correct_count, len(answers), json.dumps(answers),
+    )
+    await conn.executemany(
+        upsert_sql,
+        [(user_id, topic, c, n) for topic, (c, n) in per_topic.items()],
+    )
+    await conn.executemany(
+        "INSERT INTO type_stats (user_id, question_type, correct, total) "
+        "VALUES ($1, $2, $3, $4) "
+        "ON CONFLICT (user_id, question_type) DO UPDATE SET "
+        "  correct = type_stats.correct + EXCLUDED.correct, "
+        "  total   = type_stats.total + EXCLUDED.total",
+        [(user_id, qtype, c, n) for qtype, (c, n) in per_type.items()],
+    )
+    await _update_topic_memory(conn, user_id, answers)
+    await conn.execute("DELETE FROM prefetched_quizzes WHERE user_id = $1", user_id)
+    # The paused copy goes in the same transaction, so it survives until the results commit.
+    await conn.execute("DELETE FROM paused_sessions WHERE user_id = $1", user_id)
+
+
+_clear_all_sql = None  # built on first use; the schema only changes on deploy (init_db)
+
+
+async def _build_clear_all_sql(conn) -> str:
+    """One statement that wipes every per-user statistics table and returns the answer count."""
+    # Preserve profile/account info and clear every other table that stores
+    # rows by user_id. This keeps admin reset future-proof when new
+    # statistics tables are added.
+    tables = await conn.fetch(
+        """
+        SELECT DISTINCT table_name
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND column_name = 'user_id'
+          AND table_name NOT IN ('users', 'user_profiles', 'quiz_sessions')
+        ORDER BY table_name
+        """
+    )
+    ctes = [
+        "d_sessions AS (DELETE FROM quiz_sessions WHERE user_id=$1 "
+        "RETURNING jsonb_array_length(COALESCE(answers, '[]'::jsonb)) AS n)"
+    ]
+    for i, row in enumerate(tables):
+        safe_name = row["table_name"].replace('"', '""')
+        ctes.append(f'd{i} AS (DELETE FROM "{safe_name}" WHERE user_id=$1)')
+    return "WITH " + ",\n     ".join(ctes) + "\nSELECT COALESCE(SUM(n), 0) FROM d_sessions"
 
 
 async def _clear_all(user_id: int):
     """
     Wipe every per-user statistics table while keeping user account/profile info.
     Returns number of answers deleted.
+
+    All deletes run as data-modifying CTEs of a single statement — atomic and
+    one round-trip, without an explicit transaction.
     """
+    global _clear_all_sql
     async with _acquire() as conn:
-        async with conn.transaction():
-            count = await conn.fetchval(
-                "SELECT COUNT(*) FROM answers WHERE user_id=$1", user_id,
-            )
+        if _clear_all_sql is None:
+            _clear_all_sql = await _build_clear_all_sql(conn)
+        return await conn.fetchval(_clear_all_sql, user_id)
 
-            # Preserve profile/account info and clear every other table that stores
-            # rows by user_id. This keeps admin reset future-proof when new
-            # statistics tables are added.
-            tables = await conn.fetch(
-                """
-                SELECT table_name
-                FROM information_schema.columns
-                WHERE table_schema = 'public'
-                  AND column_name = 'user_id'
-                  AND table_name NOT IN ('users', 'user_profiles')
-                ORDER BY table_name
-                """
-            )
-            for row in tables:
-                table_name = row["table_name"]
-                safe_name = table_name.replace('"', '""')
-                await conn.execute(
-                    f'DELETE FROM "{safe_name}" WHERE user_id=$1',
-                    user_id,
-                )
-            return count
+
+# ─── Result write queue ────────────────────────────────────────────────────────
+#
+# finish_quiz only enqueues; result_writer() persists in the background so the
+# user sees their score without waiting on the DB. Readers of a user's statistics
+# first wait for that user's queued write (see _wait_for_pending_save).
+# Whatever has piled up is written in one transaction (one commit), with a
+# savepoint per quiz so a bad row only rolls back its own quiz. A quiz whose write
+# fails is put back on the queue with exponential backoff, up to _SAVE_MAX_ATTEMPTS.
+
+_SAVE_BATCH_MAX = 64
+_SAVE_MAX_ATTEMPTS = 4
+_SAVE_RETRY_BASE_SEC = 2.0  # delay before retry n is _SAVE_RETRY_BASE_SEC * 2**(n-1)
+_save_queue = asyncio.Queue()
+_pending_saves = {}  # user_id -> future resolved once the latest queued write is done
+_save_retries = set()  # strong refs to backoff tasks waiting to requeue a failed write
 
 
 async def save_result(user_id: int, answers: list):
-    await _save_all(user_id, answers)
+    """Queue a finished quiz for result_writer() and return immediately."""
+    fut = asyncio.get_running_loop().create_future()
+    _pending_saves[user_id] = fut
+    await _save_queue.put((user_id, answers, fut, 1))
+
+
+async def _wait_for_pending_save(user_id: int) -> None:
+    fut = _pending_saves.get(user_id)
+    if fut is not None:
+        await asyncio.shield(fut)
+
+
+async def _requeue_save(item: tuple, delay: float) -> None:
+    """Put a failed write back on the queue after a backoff delay.
+
+    The original entry is only marked done once the retry is queued, so
+    post_shutdown's join() keeps waiting for quizzes that are still retrying.
+    """
+    try:
+        await asyncio.sleep(delay)
+        await _save_queue.put(item)
+    finally:
+        _save_queue.task_done()
+
+
+async def result_writer(app):
+    """Background task: drain the result queue in batches of up to _SAVE_BATCH_MAX quizzes.
+
+    A quiz that still fails after its last retry is reported to admin_events and
+    to the user, whose score page has already been sent.
+    """
+    while True:
+        batch = [await _save_queue.get()]
+        while len(batch) < _SAVE_BATCH_MAX and not _save_queue.empty():
+            batch.append(_save_queue.get_nowait())
+
+        failed = {}  # batch index -> (exception, traceback)
+        try:
+            async with _acquire() as conn:
+                async with conn.transaction():
+                    # Postgres' counterpart of SQLite's synchronous=NORMAL: don't block the
+                    # writer on the WAL flush. A crash can lose the last few hundred ms of
+                    # results, never corrupt them; readers are unaffected either way.
+                    await conn.execute("SET LOCAL synchronous_commit = off")
+                    for i, (user_id, answers, _, _) in enumerate(batch):
+                        try:
+                            async with conn.transaction():
+                                await _save_all(conn, user_id, answers)
+                        except Exception as e:
+                            failed[i] = (e, traceback.format_exc())
+        except Exception as e:
+            tb = traceback.format_exc()
+            failed = {i: (e, tb) for i in range(len(batch))}
+
+        for i, (user_id, answers, fut, attempt) in enumerate(batch):
+            if i in failed and attempt < _SAVE_MAX_ATTEMPTS:
+                delay = _SAVE_RETRY_BASE_SEC * 2 ** (attempt - 1)
+                print(
+                    f"[save] user={user_id} attempt {attempt} failed, retrying in {delay:.0f}s: {failed[i][0]}",
+                    flush=True,
+                )
+                task = asyncio.create_task(_requeue_save((user_id, answers, fut, attempt + 1), delay))
+                _save_retries.add(task)
+                task.add_done_callback(_save_retries.discard)
+                continue
+            try:
+                if i in failed:
+                    e, tb = failed[i]
+                    await log_admin_event(
+                        "ERROR", "save_result_failed", f"Failed to save quiz results: {e}",
+                        details=tb, user_id=user_id,
+                    )
+                    await _quietly(app.bot.send_message(
+                        user_id,
+                        f"⚠️ <b>Не удалось сохранить результаты квиза:</b>\n<code>{h(str(e))}</code>",
+                        parse_mode="HTML",
+                    ))
+            finally:
+                _invalidate_compact_cache(user_id)
+                if not fut.done():
+                    fut.set_result(None)
+                if _pending_saves.get(user_id) is fut:
+                    del _pending_saves[user_id]
+                _save_queue.task_done()
 
 
 async def clear_history(user_id: int):
-    return await _clear_all(user_id)
+    await _wait_for_pending_save(user_id)
+    try:
+        return await _clear_all(user_id)
+    finally:
+        _invalidate_compact_cache(user_id)
 
 
 async def _admin_list_users_with_quiz_counts():
@@ -597,34 +870,59 @@ async def _admin_recent_events(limit: int = 8):
 
 # ─── Paused-session persistence (cross-device / bot-restart resume) ─────────────
 
-async def _save_paused_session(user_id: int, session: dict) -> None:
+async def _save_paused_session(user_id: int, session: "QuizSession") -> None:
     """Upsert the current in-progress quiz state to the DB so it survives restarts
     and can be resumed from any device."""
     expires_at = datetime.now(timezone.utc) + timedelta(hours=PAUSED_SESSION_TTL_HOURS)
     async with _acquire() as conn:
         await conn.execute(
             """
-            INSERT INTO paused_sessions (user_id, questions, current_idx, answers, session_dates, updated_at, expires_at)
-            VALUES ($1, $2::jsonb, $3, $4::jsonb, $5::jsonb, NOW(), $6)
+            INSERT INTO paused_sessions (user_id, questions, current_idx, answers, updated_at, expires_at)
+            VALUES ($1, $2::jsonb, $3, $4::jsonb, NOW(), $5)
             ON CONFLICT (user_id) DO UPDATE SET
                 questions     = EXCLUDED.questions,
                 current_idx   = EXCLUDED.current_idx,
                 answers       = EXCLUDED.answers,
-                session_dates = EXCLUDED.session_dates,
                 updated_at    = NOW(),
                 expires_at    = EXCLUDED.expires_at
             """,
             user_id,
-            json.dumps(session["questions"]),
-            session["current"],
-            json.dumps(session["answers"]),
-            json.dumps(session["session_dates"]),
+            json.dumps(session.questions),
+            session.current,
+            json.dumps(session.answers),
             expires_at,
         )
 
 
-async def _load_paused_session(user_id: int) -> dict | None:
-    """Return the paused session dict if one exists and has not expired, else None."""
+def _questions_playable(questions) -> bool:
+    """Shape check for question sets read back from the DB (paused / prefetched).
+
+    They were validated when generated, but a row written by an older deploy or
+    edited by hand must not crash send_question / handle_answer mid-quiz.
+    Content rules (topics, duplicate options) are deliberately not re-checked.
+    """
+    if not isinstance(questions, list) or not questions:
+        return False
+    for q in questions:
+        if not isinstance(q, dict):
+            return False
+        opts = q.get("options")
+        idx = q.get("correctIndex")
+        if not (
+            isinstance(q.get("question"), str)
+            and isinstance(q.get("explanation"), str)
+            and isinstance(q.get("topic"), str)
+            and isinstance(q.get("type"), str)
+            and isinstance(opts, list) and 0 < len(opts) <= len(LETTERS)
+            and all(isinstance(o, str) for o in opts)
+            and isinstance(idx, int) and 0 <= idx < len(opts)
+        ):
+            return False
+    return True
+
+
+async def _load_paused_session(user_id: int) -> "QuizSession | None":
+    """Return the paused session if one exists and has not expired, else None."""
 
     def _decode_jsonb(value, fallback):
         """Handle JSONB decoded as text (default asyncpg) or native Python objects (custom codec)."""
@@ -639,22 +937,22 @@ async def _load_paused_session(user_id: int) -> dict | None:
                 return fallback
         return fallback
 
+    # A just-finished quiz keeps its paused row until result_writer() commits it.
+    await _wait_for_pending_save(user_id)
     async with _acquire() as conn:
         row = await conn.fetchrow(
-            "SELECT questions, current_idx, answers, session_dates "
+            "SELECT questions, current_idx, answers "
             "FROM paused_sessions "
             "WHERE user_id = $1 AND expires_at > NOW()",
             user_id,
         )
     if not row:
         return None
-    return {
-        "questions":     _decode_jsonb(row["questions"], []),
-        "current":       row["current_idx"],
-        "answers":       _decode_jsonb(row["answers"], []),
-        "awaiting":      True,
-        "session_dates": _decode_jsonb(row["session_dates"], []),
-    }
+    questions = _decode_jsonb(row["questions"], [])
+    if not _questions_playable(questions) or not 0 <= row["current_idx"] < len(questions):
+        print(f"[paused_session] user={user_id} discarding malformed paused session", flush=True)
+        return None
+    return QuizSession(questions, row["current_idx"], _decode_jsonb(row["answers"], []))
 
 
 async def _delete_paused_session(user_id: int) -> None:
@@ -663,6 +961,61 @@ async def _delete_paused_session(user_id: int) -> None:
         await conn.execute("DELETE FROM paused_sessions WHERE user_id = $1", user_id)
 
 
+# ─── Prefetched quizzes ───────────────────────────────────────────────────────
+#
+# quiz_prefetcher() generates the next quiz overnight so that /quiz can start
+# without waiting for OpenAI. Each prefetch stores a fingerprint of the inputs it
+# was planned from (stats, spaced-repetition state, profile, prompt version) and
+# is only served if the inputs at /quiz time hash to the same value. Finished
+# quizzes and profile edits also delete it outright, and it is never served once
+# older than a day. The calendar day is deliberately not hashed: the prefetch runs
+# at a local hour, which on the server's clock can fall on the previous day.
+
+def _quiz_inputs_fingerprint(stats, session_dates, topic_memory, profile) -> str:
+    payload = json.dumps(
+        [PROMPT_DIGEST, stats, session_dates, topic_memory, profile],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+async def _store_prefetched_quiz(user_id: int, questions: list, fingerprint: str) -> None:
+    async with _acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO prefetched_quizzes (user_id, questions, fingerprint, created_at)
+            VALUES ($1, $2::jsonb, $3, NOW())
+            ON CONFLICT (user_id) DO UPDATE SET
+                questions   = EXCLUDED.questions,
+                fingerprint = EXCLUDED.fingerprint,
+                created_at  = EXCLUDED.created_at
+            """,
+            user_id,
+            json.dumps(questions),
+            fingerprint,
+        )
+
+
+async def _take_prefetched_quiz(user_id: int, fingerprint: str) -> list | None:
+    """Consume the user's prefetched quiz, or return None if there is no matching fresh one."""
+    async with _acquire() as conn:
+        row = await conn.fetchrow(
+            "DELETE FROM prefetched_quizzes WHERE user_id = $1 "
+            "RETURNING questions, fingerprint, created_at > NOW() - INTERVAL '1 day' AS fresh",
+            user_id,
+        )
+    if not row or not row["fresh"] or row["fingerprint"] != fingerprint:
+        return None
+    questions = row["questions"]
+    if isinstance(questions, str):
+        questions = json.loads(questions)
+    if len(questions) != QUIZ_QUESTION_COUNT or not _questions_playable(questions):
+        return None
+    # Fresh answer positions, as a just-generated set would get.
+    return shuffle_options(questions)
+
+
 # ─── Stats helpers ─────────────────────────────────────────────────────────────
 
 def calc_streak(session_dates):
@@ -670,40 +1023,113 @@ def calc_streak(session_dates):
     if not session_dates:
         return 0, 0
 
-    parsed_dates = [date.fromisoformat(d) for d in session_dates]
+    # Day ordinals: plain int subtraction instead of a timedelta per pair.
+    days = [date.fromisoformat(d).toordinal() for d in session_dates]
     best = cur = 1
-    for i in range(1, len(parsed_dates)):
-        diff = (parsed_dates[i] - parsed_dates[i - 1]).days
+    for prev, day in zip(days, days[1:]):
+        diff = day - prev
         if diff == 1:
             cur += 1
             best = max(best, cur)
         elif diff > 1:
             cur = 1
 
-    diff = (date.today() - parsed_dates[-1]).days
+    diff = date.today().toordinal() - days[-1]
     current = cur if diff <= 1 else 0
     return current, best
 
-def type_stats_all(history):
-    """Per question-type accuracy from full history (used only in /stats display)."""
-    stats = {}
-    for r in history:
-        qt = r.get("type", "")
-        if not qt:
-            continue
-        stats.setdefault(qt, {"correct": 0, "total": 0})
-        stats[qt]["total"] += 1
-        if r.get("correct"):
-            stats[qt]["correct"] += 1
-    return stats
+
+# user_id -> ((len(session_dates), last date, today), (current, best)). Dates only
+# ever grow by one per day, so length + last date identify the list well enough;
+# the day is part of the key because "current" decays at midnight.
+_streak_cache = {}
+
+
+def _user_streak(user_id: int, session_dates) -> tuple:
+    """calc_streak(session_dates), memoised per user until the dates or the day change."""
+    key = (len(session_dates), session_dates[-1] if session_dates else None, date.today())
+    cached = _streak_cache.get(user_id)
+    if cached and cached[0] == key:
+        return cached[1]
+    result = calc_streak(session_dates)
+    _streak_cache[user_id] = (key, result)
+    return result
 
 # ─── AI prompt ─────────────────────────────────────────────────────────────────
 
 
 # ─── Session storage ───────────────────────────────────────────────────────────
 
-user_sessions = {}
+class QuizSession:
+    """In-memory state of one user's running quiz (one instance per entry in user_sessions).
+
+    Slotted rather than a dict: it is touched on every answer and there is one per
+    active user. texts / keyboards / results are the pre-rendered messages from
+    _render_questions, so the answer path does no formatting.
+    """
+
+    __slots__ = ("questions", "current", "answers", "correct_count", "awaiting",
+                 "texts", "keyboards", "results", "last_active")
+
+    def __init__(self, questions: list, current: int = 0, answers: list | None = None):
+        self.questions = questions
+        self.current = current
+        self.answers = answers if answers is not None else []
+        self.correct_count = sum(1 for a in self.answers if a.get("correct"))
+        self.awaiting = True
+        self.texts, self.keyboards, self.results = _render_questions(questions)
+        self.last_active = time.monotonic()
+
+
+user_sessions = {}  # user_id -> QuizSession
 user_answer_locks = {}
+_background_sends = set()  # strong refs so in-flight fire-and-forget tasks are not garbage-collected
+
+
+async def _quietly(coro) -> None:
+    try:
+        await coro
+    except Exception:
+        pass
+
+
+def _spawn_quietly(coro) -> None:
+    """Run a best-effort Bot API call (ack, progress edit) without waiting for it."""
+    task = asyncio.create_task(_quietly(coro))
+    _background_sends.add(task)
+    task.add_done_callback(_background_sends.discard)
+
+
+# Users whose new quiz is being prepared. Updates run concurrently, so without this a
+# double-tapped /quiz (or "Начать заново") would pay for two OpenAI generations.
+_quiz_starting = set()
+
+# user_id -> (last question index, monotonic time) of the quiz the user just finished.
+# A second tap on that final question arrives after finish_quiz has dropped the
+# session and must not be answered with "session expired" under the score page.
+_recently_finished = {}
+_RECENTLY_FINISHED_SEC = 300
+
+
+def _put_session(user_id: int, session: QuizSession) -> None:
+    """Register a running quiz, keeping at most MAX_IN_MEMORY_SESSIONS in memory.
+
+    session_janitor() drops idle sessions on a timer; this cap bounds memory between
+    sweeps. Every session has a paused_sessions copy, so an evicted quiz is simply
+    restored from the DB on the user's next tap. Sessions whose answer is being
+    processed right now (lock held) are never evicted.
+    """
+    user_sessions[user_id] = session
+    if len(user_sessions) <= MAX_IN_MEMORY_SESSIONS:
+        return
+    candidates = [
+        (sess.last_active, uid) for uid, sess in user_sessions.items()
+        if uid != user_id and not (uid in user_answer_locks and user_answer_locks[uid].locked())
+    ]
+    if candidates:
+        _, victim = min(candidates)
+        del user_sessions[victim]
+        print(f"[sessions] cap {MAX_IN_MEMORY_SESSIONS} reached, evicted user={victim}", flush=True)
 
 
 def _get_user_answer_lock(user_id: int) -> asyncio.Lock:
@@ -874,10 +1300,7 @@ async def quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    try:
-        await query.answer()
-    except Exception:
-        pass
+    # The callback was already acknowledged by handle_answer.
 
     if query.data == "menu_quiz":
         if not await _is_onboarding_complete(query.from_user.id):
@@ -909,8 +1332,8 @@ async def start_quiz(message, user_id):
     # Restore a paused session if one exists (survives bot restarts and device switches).
     paused = await _load_paused_session(user_id)
     if paused:
-        answered = paused["current"]
-        total = len(paused["questions"])
+        answered = paused.current
+        total = len(paused.questions)
         keyboard = [[
             InlineKeyboardButton("▶️ Продолжить", callback_data="quiz_resume"),
             InlineKeyboardButton("🔄 Начать заново", callback_data="quiz_restart"),
@@ -925,36 +1348,78 @@ async def start_quiz(message, user_id):
     await _start_new_quiz(message, user_id)
 
 
+async def _load_quiz_inputs(user_id: int) -> tuple:
+    """Everything quiz planning depends on: (stats, session_dates, topic_memory, profile)."""
+    t_start = time.monotonic()
+    print(f"[quiz] user={user_id} loading data …", flush=True)
+    # Independent reads on separate pooled connections: one round-trip of wall time, not three.
+    (stats, session_dates), topic_memory, profile = await asyncio.gather(
+        _load_compact_data(user_id), _load_topic_memory(user_id), _load_profile(user_id),
+    )
+    profile = profile or {}
+    print(f"[quiz] user={user_id} data loaded in {time.monotonic()-t_start:.1f}s", flush=True)
+    return stats, session_dates, topic_memory, profile
+
+
+async def _generate_quiz_questions(user_id: int, inputs: tuple, on_progress=None) -> list:
+    """Plan topics from the user's stats and generate a full question set."""
+    stats, session_dates, topic_memory, profile = inputs
+    required_topics = build_topic_sequence(stats, session_dates, topic_memory, total_questions=QUIZ_QUESTION_COUNT)
+    print(f"[quiz] user={user_id} generating questions …", flush=True)
+
+    t_gen = time.monotonic()
+    questions = await asyncio.wait_for(
+        generate_questions(stats, session_dates, profile, required_topics=required_topics, on_progress=on_progress),
+        timeout=QUIZ_GENERATION_TIMEOUT_SEC,
+    )
+    print(f"[quiz] user={user_id} questions generated in {time.monotonic()-t_gen:.1f}s", flush=True)
+    return questions
+
+
 async def _start_new_quiz(message, user_id):
     """Generate fresh questions and start a new quiz, discarding any paused state."""
+    if user_id in _quiz_starting:
+        await message.reply_text("⏳ Квиз уже готовится, подожди немного.")
+        return
+    _quiz_starting.add(user_id)
+    try:
+        await _prepare_new_quiz(message, user_id)
+    finally:
+        _quiz_starting.discard(user_id)
+
+
+async def _prepare_new_quiz(message, user_id):
     msg = await message.reply_text("⏳ Готовлю квиз... Это займёт около минуты.")
     try:
-        t_start = time.monotonic()
-        print(f"[quiz] user={user_id} loading data …", flush=True)
-        stats, session_dates = await _load_compact_data(user_id)
-        topic_memory = await _load_topic_memory(user_id)
-        profile = await _load_profile(user_id) or {}
-        required_topics = build_topic_sequence(stats, session_dates, topic_memory, total_questions=QUIZ_QUESTION_COUNT)
-        print(f"[quiz] user={user_id} data loaded in {time.monotonic()-t_start:.1f}s, generating questions …", flush=True)
-
-        t_gen = time.monotonic()
-        questions = await asyncio.wait_for(
-            generate_questions(stats, session_dates, profile, required_topics=required_topics),
-            timeout=QUIZ_GENERATION_TIMEOUT_SEC,
+        inputs = await _load_quiz_inputs(user_id)
+        questions = await _take_prefetched_quiz(user_id, _quiz_inputs_fingerprint(*inputs))
+        if questions is not None:
+            print(f"[quiz] user={user_id} using prefetched questions", flush=True)
+        else:
+            # The quiz can only start once all questions are validated, so show how far
+            # the stream has got instead of a static minute-long wait (every 5 questions).
+            shown = 0
+
+            def _on_progress(done: int) -> None:
+                nonlocal shown
+                step = done - done % 5
+                if shown < step < QUIZ_QUESTION_COUNT:
+                    shown = step
+                    _spawn_quietly(msg.edit_text(
+                        f"⏳ Готовлю квиз... {step} из {QUIZ_QUESTION_COUNT} вопросов готово."
+                    ))
+
+            questions = await _generate_quiz_questions(user_id, inputs, _on_progress)
+
+        session = QuizSession(questions)
+        _put_session(user_id, session)
+        # Independent round-trips: the resumable DB copy, dropping the "⏳" notice and
+        # sending question 1 all go out at once.
+        await asyncio.gather(
+            _save_paused_session(user_id, session),
+            _quietly(msg.delete()),
+            send_question(message, user_id),
         )
-        print(f"[quiz] user={user_id} questions generated in {time.monotonic()-t_gen:.1f}s", flush=True)
-
-        session = {
-            "questions": questions,
-            "current": 0,
-            "answers": [],
-            "awaiting": True,
-            "session_dates": session_dates,
-        }
-        user_sessions[user_id] = session
-        await _save_paused_session(user_id, session)
-        await msg.delete()
-        await send_question(message, user_id)
     except asyncio.TimeoutError:
         print(f"[quiz] user={user_id} TIMEOUT: OpenAI did not respond in {QUIZ_GENERATION_TIMEOUT_SEC:.0f}s", flush=True)
         try:
@@ -972,26 +1437,54 @@ async def _start_new_quiz(message, user_id):
         except Exception:
             pass
 
+def _render_questions(questions: list) -> tuple[list, list, list]:
+    """Pre-render every question's message text, answer keyboard and feedback texts.
+
+    results[idx][selected] is the reply shown after picking option `selected`.
+
+    Done once when the quiz is created (or restored from paused_sessions) so that
+    send_question only has to send. The rendered objects live in memory only —
+    _save_paused_session persists the raw questions, not these.
+    """
+    total = len(questions)
+    texts, keyboards, results = [], [], []
+    for idx, q in enumerate(questions):
+        type_label = TYPE_LABELS.get(q.get("type", ""), "❓ Вопрос")
+        texts.append(
+            f"<b>Вопрос {idx + 1} из {total}</b>  •  {type_label}\n"
+            f"📌 <i>Тема: {h(q['topic'])}</i>\n\n"
+            f"❓ {h(q['question'])}"
+        )
+        keyboards.append(InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"{LETTERS[i]}. {opt}", callback_data=f"ans_{idx}_{i}")]
+            for i, opt in enumerate(q["options"])
+        ]))
+
+        correct_idx = q["correctIndex"]
+        correct_line = f"{h(LETTERS[correct_idx])}. {h(q['options'][correct_idx])}"
+        explanation = f"💡 {h(q['explanation'])}"
+        results.append([
+            f"✅ <b>Верно!</b>\n\n<b>{correct_line}</b>\n\n{explanation}"
+            if i == correct_idx else
+            f"❌ <b>Неверно.</b>\n\n"
+            f"Твой ответ: {h(LETTERS[i])}. {h(opt)}\n"
+            f"✅ Правильный ответ: <b>{correct_line}</b>\n\n"
+            f"{explanation}"
+            for i, opt in enumerate(q["options"])
+        ])
+    return texts, keyboards, results
+
+
 async def send_question(message, user_id):
     session = user_sessions.get(user_id)
     if session is None:
         await message.reply_text("⚠️ Сессия не найдена. Начни квиз заново через /quiz")
         return
-    q = session["questions"][session["current"]]
-    num = session["current"] + 1
-    total = len(session["questions"])
-
-    type_label = TYPE_LABELS.get(q.get("type", ""), "❓ Вопрос")
-    question_idx = session["current"]
-    keyboard = [
-        [InlineKeyboardButton(f"{LETTERS[i]}. {opt}", callback_data=f"ans_{question_idx}_{i}")]
-        for i, opt in enumerate(q["options"])
-    ]
+    idx = session.current
+    session.last_active = time.monotonic()
     await message.reply_text(
-        f"<b>Вопрос {num} из {total}</b>  •  {type_label}\n"
-        f"📌 <i>Тема: {h(q['topic'])}</i>\n\n"
-        f"❓ {h(q['question'])}",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        session.texts[idx],
+        reply_markup=session.keyboards[idx],
         parse_mode="HTML",
     )
 
@@ -1004,6 +1497,10 @@ PROFILE_FIELD_LABELS = {
 }
 
 
+def _ack_callback(query) -> None:
+    _spawn_quietly(query.answer())
+
+
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     if not is_access_allowed(query.from_user):
@@ -1012,6 +1509,14 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     data = query.data
 
+    # Acknowledge the callback before any DB/network work so the button spinner
+    # stops immediately — Telegram requires this within 10 seconds and a callback
+    # can only be answered once, so every branch below replies with messages;
+    # malformed callback data (stale or tampered buttons) is ignored silently.
+    # The ack runs as its own task: nothing below depends on it, so the handler
+    # does not wait out its round-trip.
+    _ack_callback(query)
+
     async def _clear_reply_markup() -> None:
         """Safely remove inline keyboard from callback message.
 
@@ -1031,10 +1536,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ── Onboarding start ──
     if data == "start_onboarding":
-        try:
-            await query.answer()
-        except Exception:
-            pass
         context.user_data["state"] = STATE_ONBOARDING
         context.user_data["step"] = 0
         context.user_data["onboarding_data"] = {}
@@ -1043,10 +1544,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ── Onboarding choice answer ──
     if data.startswith("onb_"):
-        try:
-            await query.answer()
-        except Exception:
-            pass
 
         # Remove "onb_" prefix then split on the LAST underscore so that
         # keys containing underscores (e.g. "native_lang", "other_langs") are
@@ -1054,18 +1551,15 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         remainder = data[4:]  # strip "onb_"
         key, sep, opt_idx_str = remainder.rpartition("_")
         if not sep or not key or not opt_idx_str.isdigit():
-            await query.answer("Некорректные данные", show_alert=True)
             return
 
         step = next((s for s in ONBOARDING_STEPS if s["key"] == key and s.get("type") == "choice"), None)
         if not step:
-            await query.answer("Некорректные данные", show_alert=True)
             return
 
         opt_idx = int(opt_idx_str)
         options = step.get("options") or []
         if not (0 <= opt_idx < len(options)):
-            await query.answer("Некорректные данные", show_alert=True)
             return
 
         try:
@@ -1085,10 +1579,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ── Settings ──
     if data == "settings_view":
-        try:
-            await query.answer()
-        except Exception:
-            pass
         profile = await _load_profile(user_id)
         if not profile:
             await query.message.reply_text("Профиль не заполнен. Нажми /start чтобы пройти анкету.")
@@ -1100,10 +1590,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "settings_edit_menu":
-        try:
-            await query.answer()
-        except Exception:
-            pass
         keyboard = [
             [InlineKeyboardButton(label, callback_data=f"setedit_{key}")]
             for key, label in PROFILE_FIELD_LABELS.items()
@@ -1116,10 +1602,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("setedit_"):
-        try:
-            await query.answer()
-        except Exception:
-            pass
         field = data[len("setedit_"):]
         step = next((s for s in ONBOARDING_STEPS if s["key"] == field), None)
         label = PROFILE_FIELD_LABELS.get(field, field)
@@ -1139,10 +1621,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("setopt_"):
-        try:
-            await query.answer()
-        except Exception:
-            pass
 
         # Remove "setopt_" prefix then split on the LAST underscore so that
         # fields containing underscores (e.g. "native_lang", "other_langs")
@@ -1150,18 +1628,15 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         remainder = data[7:]  # strip "setopt_"
         field, sep, opt_idx_str = remainder.rpartition("_")
         if not sep or not field or not opt_idx_str.isdigit():
-            await query.answer("Некорректные данные", show_alert=True)
             return
 
         step = next((s for s in ONBOARDING_STEPS if s["key"] == field and s.get("type") == "choice"), None)
         if not step:
-            await query.answer("Некорректные данные", show_alert=True)
             return
 
         opt_idx = int(opt_idx_str)
         options = step.get("options") or []
         if not (0 <= opt_idx < len(options)):
-            await query.answer("Некорректные данные", show_alert=True)
             return
 
         try:
@@ -1176,10 +1651,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "settings_reset_ask":
-        try:
-            await query.answer()
-        except Exception:
-            pass
         keyboard = [[
             InlineKeyboardButton("🗑 Да, сбросить", callback_data="settings_reset_confirm"),
             InlineKeyboardButton("❌ Отмена",        callback_data="settings_back"),
@@ -1191,10 +1662,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "settings_reset_confirm":
-        try:
-            await query.answer()
-        except Exception:
-            pass
         await _clear_reply_markup()
         await _reset_profile(user_id)
         context.user_data.clear()
@@ -1204,10 +1671,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "settings_back":
-        try:
-            await query.answer()
-        except Exception:
-            pass
         await query.message.reply_text(
             "📋 Главное меню:",
             reply_markup=InlineKeyboardMarkup(get_main_menu_keyboard(query.from_user)),
@@ -1215,10 +1678,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "admin_user_stats":
-        try:
-            await query.answer()
-        except Exception:
-            pass
         if not is_owner(query.from_user):
             await query.message.reply_text("⛔ Доступ запрещён.")
             return
@@ -1226,10 +1685,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "admin_logs":
-        try:
-            await query.answer()
-        except Exception:
-            pass
         if not is_owner(query.from_user):
             await query.message.reply_text("⛔ Доступ запрещён.")
             return
@@ -1237,10 +1692,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("admin_reset_confirm_"):
-        try:
-            await query.answer()
-        except Exception:
-            pass
         if not is_owner(query.from_user):
             await query.message.reply_text("⛔ Доступ запрещён.")
             return
@@ -1260,10 +1711,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("admin_reset_"):
-        try:
-            await query.answer()
-        except Exception:
-            pass
         if not is_owner(query.from_user):
             await query.message.reply_text("⛔ Доступ запрещён.")
             return
@@ -1293,10 +1740,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ── Reset stats (from settings menu) ──
     if data == "reset_ask":
-        try:
-            await query.answer()
-        except Exception:
-            pass
         keyboard = [[
             InlineKeyboardButton("🗑 Да, удалить всё", callback_data="reset_confirm"),
             InlineKeyboardButton("❌ Отмена",           callback_data="reset_cancel"),
@@ -1316,12 +1759,7 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ── Reset confirmation ──
     if data == "reset_confirm":
         try:
-            await query.answer()
-        except Exception:
-            pass
-        await _clear_reply_markup()
-        try:
-            count = await clear_history(user_id)
+            _, count = await asyncio.gather(_quietly(_clear_reply_markup()), clear_history(user_id))
             await query.message.reply_text(
                 f"🗑 <b>История очищена.</b>\n"
                 f"Удалено ответов: {count}\n"
@@ -1337,25 +1775,18 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "reset_cancel":
-        try:
-            await query.answer()
-        except Exception:
-            pass
-        await _clear_reply_markup()
-        await query.message.reply_text("✅ Отмена. История не тронута.")
+        await asyncio.gather(
+            _clear_reply_markup(),
+            query.message.reply_text("✅ Отмена. История не тронута."),
+        )
         return
 
     if data == "quiz_resume":
-        try:
-            await query.answer()
-        except Exception:
-            pass
-        await _clear_reply_markup()
-        paused = await _load_paused_session(user_id)
+        _, paused = await asyncio.gather(_clear_reply_markup(), _load_paused_session(user_id))
         if paused:
-            user_sessions[user_id] = paused
-            answered = paused["current"]
-            total = len(paused["questions"])
+            _put_session(user_id, paused)
+            answered = paused.current
+            total = len(paused.questions)
             await query.message.reply_text(
                 f"⏸ Продолжаю незавершённый квиз ({answered} из {total} вопросов пройдено).",
             )
@@ -1365,12 +1796,7 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "quiz_restart":
-        try:
-            await query.answer()
-        except Exception:
-            pass
-        await _clear_reply_markup()
-        await _delete_paused_session(user_id)
+        await asyncio.gather(_clear_reply_markup(), _delete_paused_session(user_id))
         if user_id in user_sessions:
             del user_sessions[user_id]
         await _start_new_quiz(query.message, user_id)
@@ -1378,10 +1804,6 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ── Quiz answer ──
     if not data.startswith("ans_"):
-        try:
-            await query.answer()
-        except Exception:
-            pass
         return
 
     lock = _get_user_answer_lock(user_id)
@@ -1390,21 +1812,22 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Try to restore a paused session from the DB (e.g. after bot restart or from another device).
             paused = await _load_paused_session(user_id)
             if paused:
-                user_sessions[user_id] = paused
+                _put_session(user_id, paused)
             else:
-                try:
-                    await query.answer("Сессия истекла. Напиши /quiz чтобы начать заново.")
-                except Exception:
-                    pass
+                finished = _recently_finished.get(user_id)
+                parts = data.split("_")
+                if (
+                    finished
+                    and time.monotonic() - finished[1] < _RECENTLY_FINISHED_SEC
+                    and len(parts) == 3 and parts[1] == str(finished[0])
+                ):
+                    return  # duplicate tap on the last question of the quiz that just ended
+                await query.message.reply_text("Сессия истекла. Напиши /quiz чтобы начать заново.")
                 return
 
         session = user_sessions[user_id]
-        if not session.get("awaiting"):
-            try:
-                await query.answer("Ответ уже принят.")
-            except Exception:
-                pass
-            return
+        if not session.awaiting:
+            return  # duplicate tap — the answer is already being processed
 
         parts = data.split("_")
         try:
@@ -1413,87 +1836,78 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 selected = int(parts[2])
             else:
                 # Backward compatibility with old callback format ans_<option>.
-                q_idx = session["current"]
+                q_idx = session.current
                 selected = int(parts[1])
         except (IndexError, ValueError):
-            try:
-                await query.answer()
-            except Exception:
-                pass
             return
 
-        if q_idx != session["current"]:
-            try:
-                await query.answer("Этот вопрос уже закрыт.")
-            except Exception:
-                pass
+        if q_idx != session.current:
+            # Stale keyboard from an already answered question.
             await _clear_reply_markup()
             return
 
-        if not (0 <= selected <= 3):
-            try:
-                await query.answer()
-            except Exception:
-                pass
+        q = session.questions[q_idx]
+        if not (0 <= selected < len(q["options"])):
             return
 
-        # Acknowledge the callback query immediately — Telegram requires this within 10 seconds.
-        # All subsequent work (edit, reply, ChatGPT API) can take much longer.
-        try:
-            await query.answer()
-        except Exception:
-            pass
-
-        session["awaiting"] = False
-        q = session["questions"][session["current"]]
+        session.awaiting = False
         correct = selected == q["correctIndex"]
 
-        session["answers"].append({
+        session.answers.append({
             "topic": q["topic"],
             "type":  q["type"],
             "correct": correct,
         })
+        session.correct_count += correct
 
-        correct_letter = LETTERS[q["correctIndex"]]
-        correct_text   = q["options"][q["correctIndex"]]
+        result = session.results[q_idx][selected]
+        question_text = session.texts[q_idx]
 
-        if correct:
-            result = (
-                f"✅ <b>Верно!</b>\n\n"
-                f"<b>{h(correct_letter)}. {h(correct_text)}</b>\n\n"
-                f"💡 {h(q['explanation'])}"
-            )
-        else:
-            sel_letter = LETTERS[selected]
-            sel_text   = q["options"][selected]
-            result = (
-                f"❌ <b>Неверно.</b>\n\n"
-                f"Твой ответ: {h(sel_letter)}. {h(sel_text)}\n"
-                f"✅ Правильный ответ: <b>{h(correct_letter)}. {h(correct_text)}</b>\n\n"
-                f"💡 {h(q['explanation'])}"
+        async def _show_result() -> None:
+            # One API call instead of two: rewrite the question message with the verdict
+            # appended, which also drops its keyboard. Fall back to the old
+            # clear-keyboard + separate reply if Telegram refuses the edit.
+            try:
+                await query.edit_message_text(
+                    f"{question_text}\n\n{result}", parse_mode="HTML", reply_markup=None,
+                )
+                return
+            except BadRequest as e:
+                if "Message is not modified" in str(e):
+                    return
+                print(f"[quiz] user={user_id} result edit failed, replying instead: {e}", flush=True)
+            await asyncio.gather(
+                _clear_reply_markup(),
+                query.message.reply_text(result, parse_mode="HTML"),
             )
 
-        await _clear_reply_markup()
-        await query.message.reply_text(result, parse_mode="HTML")
-
-        session["current"] += 1
-        if session["current"] >= len(session["questions"]):
+        session.current += 1
+        if session.current >= len(session.questions):
+            await _show_result()
             await finish_quiz(query.message, user_id)
-        else:
-            session["awaiting"] = True
+            return
+
+        session.awaiting = True
+
+        async def _persist_progress() -> None:
             # Persist progress after each answer so the quiz can be resumed from any device.
             try:
                 await _save_paused_session(user_id, session)
             except Exception as e:
                 print(f"[paused_session] save error: {e}")
+
+        async def _show_result_and_next() -> None:
+            await _show_result()
             await send_question(query.message, user_id)
 
+        # The DB write overlaps with the (ordered) result + next-question messages.
+        await asyncio.gather(_persist_progress(), _show_result_and_next())
+
 async def finish_quiz(message, user_id):
     session = user_sessions[user_id]
-    answers       = session["answers"]
-    session_dates = session.get("session_dates", [])
+    answers       = session.answers
 
-    correct_count = sum(1 for a in answers if a["correct"])
+    correct_count = session.correct_count
     total = len(answers)
     if total == 0:
         await message.reply_text("⚠️ Квиз завершён, но ответов не найдено.")
@@ -1501,22 +1915,29 @@ async def finish_quiz(message, user_id):
         return
     pct   = round(correct_count / total * 100)
 
-    # Per-topic results this session
-    topic_res = {}
+    # Per-topic results this session: topic -> [correct, total]
+    topic_res = defaultdict(lambda: [0, 0])
     for a in answers:
-        t = a["topic"]
-        topic_res.setdefault(t, {"correct": 0, "total": 0})
-        topic_res[t]["total"] += 1
+        s = topic_res[a["topic"]]
+        s[1] += 1
         if a["correct"]:
-            topic_res[t]["correct"] += 1
+            s[0] += 1
 
-    weak = sorted(
-        [(t, round(s["correct"] / s["total"] * 100)) for t, s in topic_res.items()],
-        key=lambda x: x[1]
-    )[:3]
+    weak = heapq.nsmallest(
+        3,
+        ((t, round(c / n * 100)) for t, (c, n) in topic_res.items()),
+        key=lambda x: x[1],
+    )
 
-    streak_cur, streak_best = calc_streak(session_dates)
-    today_str = datetime.now().strftime("%Y-%m-%d")
+    # Session dates are loaded here rather than carried in the session, so the
+    # O(history) list is not rewritten to paused_sessions on every answer.
+    try:
+        _, session_dates = await _load_compact_data(user_id)
+    except Exception as e:
+        print(f"[quiz] user={user_id} session dates load error: {e}", flush=True)
+        session_dates = []
+    streak_cur, streak_best = _user_streak(user_id, session_dates)
+    today_str = date.today().isoformat()
     # today is not yet in session_dates (saved after quiz) — add 1 only for first quiz of the day
     new_streak = streak_cur if (session_dates and session_dates[-1] == today_str) else streak_cur + 1
 
@@ -1539,29 +1960,17 @@ async def finish_quiz(message, user_id):
     if weak:
         text += "\n⚠️ <b>Слабые темы сегодня:</b>\n"
         for t, p in weak:
-            text += f"  • {h(t)}: {p}%\n"
+            text += f"  • {h_topic(t)}: {p}%\n"
     text += "\n▶️ Для нового квиза напиши /quiz"
 
-    try:
-        await save_result(user_id, answers)
-    except Exception as e:
-        print(f"Save error: {e}")
-        await message.reply_text(
-            f"⚠️ <b>Не удалось сохранить результаты:</b>\n<code>{h(str(e))}</code>\n\n{text}",
-            parse_mode="HTML",
-        )
-        del user_sessions[user_id]
-        try:
-            await _delete_paused_session(user_id)
-        except Exception:
-            pass
-        return
+    # Persisted by result_writer() in the background, which also drops the paused
+    # copy once the results have committed; failed writes are retried there and,
+    # if they never land, the user is told in a follow-up message.
+    await save_result(user_id, answers)
 
     del user_sessions[user_id]
-    try:
-        await _delete_paused_session(user_id)
-    except Exception:
-        pass
+    _recently_finished[user_id] = (len(session.questions) - 1, time.monotonic())
+
     await message.reply_text(text, parse_mode="HTML")
 
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1604,9 +2013,17 @@ async def show_stats(message, user_id: int):
         await message.reply_text("📊 Статистика пока пустая. Пройди первый квиз через /quiz")
         return
 
-    streak_cur, streak_best = calc_streak(session_dates)
-    total_questions = sum(s["total"]   for s in stats.values())
-    total_correct   = sum(s["correct"] for s in stats.values())
+    cache_key = (total_sessions, date.today())
+    cached = _stats_text_cache.get(user_id)
+    if cached and cached[0] == cache_key:
+        await message.reply_text(cached[1], parse_mode="HTML")
+        return
+
+    streak_cur, streak_best = _user_streak(user_id, session_dates)
+    total_questions = total_correct = 0
+    for s in stats.values():
+        total_questions += s["total"]
+        total_correct   += s["correct"]
     overall_pct     = round(total_correct / total_questions * 100) if total_questions else 0
 
     learning_days = len(session_dates)
@@ -1625,66 +2042,72 @@ async def show_stats(message, user_id: int):
         if is_learning else ""
     )
 
-    text = (
-        f"📊 <b>Твоя статистика</b>\n\n"
-        f"{learning_status}"
-        f"{exam_line}"
+    parts = [
+        "📊 <b>Твоя статистика</b>\n\n",
+        learning_status,
+        exam_line,
         f"🔥 Серия дней: {streak_cur} (рекорд: {streak_best})\n"
         f"📝 Всего сессий: {total_sessions}\n"
         f"❓ Всего вопросов: {total_questions}\n"
-        f"✅ Общий результат: <b>{overall_pct}%</b>\n"
-    )
+        f"✅ Общий результат: <b>{overall_pct}%</b>\n",
+    ]
 
     # All-time topic breakdown
     if stats:
-        weak   = sorted([(t, round(s["correct"]/s["total"]*100))
-                         for t, s in stats.items() if s["total"] >= 1
-                         and round(s["correct"]/s["total"]*100) < 60],
-                        key=lambda x: x[1])
-        medium = sorted([(t, round(s["correct"]/s["total"]*100))
-                         for t, s in stats.items() if s["total"] >= 1
-                         and 60 <= round(s["correct"]/s["total"]*100) < 85],
-                        key=lambda x: x[1])
-        strong = sorted([(t, round(s["correct"]/s["total"]*100))
-                         for t, s in stats.items() if s["total"] >= 1
-                         and round(s["correct"]/s["total"]*100) >= 85],
-                        key=lambda x: -x[1])
-        if weak:
-            text += "\n🔴 <b>Слабые темы (&lt;60%):</b>\n"
-            for t, p in weak[:5]:
-                n = stats[t]["total"]
-                text += f"  • {h(t)}: {p}% ({n} вопр.)\n"
-        if medium:
-            text += "\n🟡 <b>В процессе (60-85%):</b>\n"
-            for t, p in medium[:5]:
-                n = stats[t]["total"]
-                text += f"  • {h(t)}: {p}% ({n} вопр.)\n"
-        if strong:
-            text += "\n🟢 <b>Сильные темы (≥85%):</b>\n"
-            for t, p in strong[:5]:
-                n = stats[t]["total"]
-                text += f"  • {h(t)}: {p}% ({n} вопр.)\n"
+        # One pass: pct is computed once per topic and dropped into its bucket.
+        weak, medium, strong = [], [], []
+        for t, s in stats.items():
+            n = s["total"]
+            if n < 1:
+                continue
+            p = round(s["correct"] / n * 100)
+            (weak if p < 60 else medium if p < 85 else strong).append((t, p, n))
+        # Only the top 5 of each bucket are shown — partial sort instead of sorting everything.
+        buckets = (
+            ("\n🔴 <b>Слабые темы (&lt;60%):</b>\n", heapq.nsmallest(5, weak, key=lambda x: x[1])),
+            ("\n🟡 <b>В процессе (60-85%):</b>\n", heapq.nsmallest(5, medium, key=lambda x: x[1])),
+            ("\n🟢 <b>Сильные темы (≥85%):</b>\n", heapq.nlargest(5, strong, key=lambda x: x[1])),
+        )
+        for header, rows in buckets:
+            if rows:
+                parts.append(header)
+                parts.extend(f"  • {h_topic(t)}: {p}% ({n} вопр.)\n" for t, p, n in rows)
 
     # Topics never practiced yet
-    unseen = [t for t in MASTER_TOPICS if t not in stats or stats[t]["total"] == 0]
+    seen = {t for t, s in stats.items() if s["total"]}
+    unseen = [t for t in MASTER_TOPICS if t not in seen]
     if unseen:
-        text += f"\n⚪ <b>Ещё не изучались ({len(unseen)}):</b>\n"
-        text += ", ".join(h(t) for t in unseen) + "\n"
-
-    # Per question-type accuracy (loaded from full answers — infrequent call)
+        # Bounded so the reply stays well under Telegram's 4096-char limit however
+        # large the curriculum grows; the header still reports the full count.
+        shown = unseen[:_UNSEEN_TOPICS_SHOWN]
+        more = len(unseen) - len(shown)
+        parts.append(f"\n⚪ <b>Ещё не изучались ({len(unseen)}):</b>\n")
+        parts.append(", ".join(_TOPIC_HTML[t] for t in shown))
+        parts.append(f", … ещё {more}\n" if more else "\n")
+
+    # Per question-type accuracy (type_stats aggregates)
+    type_section_ok = False
     try:
-        history = await _load_history_for_stats(user_id)
-        type_st = type_stats_all(history)
+        type_st = await _load_type_stats(user_id)
         if type_st:
-            text += "\n📋 <b>По типам вопросов:</b>\n"
-            for qt, s in sorted(type_st.items(), key=lambda x: x[1]["correct"]/max(x[1]["total"],1)):
-                pct = round(s["correct"] / s["total"] * 100) if s["total"] else 0
-                bar = "🔴" if pct < 60 else "🟡" if pct < 85 else "🟢"
-                name = TYPE_NAMES_RU.get(qt, qt)
-                text += f"  {bar} {name}: {pct}% ({s['total']} вопр.)\n"
+            type_rows = [
+                (qt, s["correct"] / s["total"] if s["total"] else 0.0, s["total"])
+                for qt, s in type_st.items()
+            ]
+            type_rows.sort(key=lambda x: x[1])
+            parts.append("\n📋 <b>По типам вопросов:</b>\n")
+            for qt, ratio, n in type_rows:
+                pct = round(ratio * 100)
+                bar = _ACCURACY_BAR[min(pct, 100)]
+                name = _TYPE_NAME_HTML.get(qt) or h(qt)
+                parts.append(f"  {bar} {name}: {pct}% ({n} вопр.)\n")
+        type_section_ok = type_st is not None
     except Exception:
         pass  # type stats are bonus — don't fail show_stats if history load fails
 
+    text = "".join(parts)
+    if type_section_ok:  # never replay a page missing the per-type block for the rest of the day
+        _stats_text_cache[user_id] = (cache_key, text)
     await message.reply_text(text, parse_mode="HTML")
 
 # ─── Text message handler (onboarding + settings edit) ────────────────────────
@@ -1895,12 +2318,104 @@ async def daily_quiz_reminder(app):
         await asyncio.sleep(60)
 
 
+async def quiz_prefetcher():
+    """Background task: pre-generate the next quiz overnight (local time) for active users.
+
+    Only users who finished a quiz in the last QUIZ_PREFETCH_ACTIVE_DAYS days are
+    considered, so idle accounts do not cost OpenAI tokens. Generation runs one
+    user at a time to stay well clear of rate limits.
+    """
+    while True:
+        utc_now = datetime.now(timezone.utc)
+        try:
+            async with _acquire() as conn:
+                users = await conn.fetch(
+                    """
+                    SELECT u.telegram_id, u.timezone
+                    FROM users u
+                    WHERE u.onboarding_complete = TRUE
+                      AND EXISTS (
+                          SELECT 1 FROM quiz_sessions qs
+                          WHERE qs.user_id = u.telegram_id
+                            AND qs.completed_at > NOW() - make_interval(days => $1)
+                      )
+                      AND NOT EXISTS (
+                          SELECT 1 FROM prefetched_quizzes p
+                          WHERE p.user_id = u.telegram_id
+                            AND p.created_at > NOW() - INTERVAL '12 hours'
+                      )
+                    """,
+                    QUIZ_PREFETCH_ACTIVE_DAYS,
+                )
+            for user in users:
+                user_id = user["telegram_id"]
+                if utc_now.astimezone(_safe_zoneinfo(user["timezone"])).hour != QUIZ_PREFETCH_LOCAL_HOUR:
+                    continue
+                if user_id in user_sessions or user_id in _quiz_starting:
+                    continue  # mid-quiz — its result would invalidate the prefetch anyway
+                try:
+                    inputs = await _load_quiz_inputs(user_id)
+                    questions = await _generate_quiz_questions(user_id, inputs)
+                    await _store_prefetched_quiz(user_id, questions, _quiz_inputs_fingerprint(*inputs))
+                except Exception as e:
+                    await log_admin_event(
+                        "WARN", "quiz_prefetch_failed", f"Quiz prefetch failed: {type(e).__name__}: {e}",
+                        user_id=user_id,
+                    )
+        except Exception as e:
+            await log_admin_event("ERROR", "quiz_prefetch_db_error", f"Quiz prefetch DB error: {e}")
+
+        await asyncio.sleep(600)
+
+
+async def session_janitor():
+    """Background task: bound in-memory per-user state and prune expired paused_sessions rows.
+
+    An abandoned quiz otherwise stays in user_sessions until the process restarts.
+    Sessions idle longer than PAUSED_SESSION_TTL_HOURS are dropped — by then their
+    DB copy has expired too, so nothing resumable is lost. The read-through caches
+    only check freshness on access, so their expired entries are swept here as well.
+    """
+    idle_limit = PAUSED_SESSION_TTL_HOURS * 3600
+    while True:
+        await asyncio.sleep(600)
+        now = time.monotonic()
+        stale = [
+            uid for uid, sess in user_sessions.items()
+            if now - sess.last_active > idle_limit
+        ]
+        for uid in stale:
+            user_sessions.pop(uid, None)
+        for uid in [u for u, lock in user_answer_locks.items() if u not in user_sessions and not lock.locked()]:
+            del user_answer_locks[uid]
+        for uid in [u for u, c in _compact_cache.items() if now - c[0] >= COMPACT_DATA_CACHE_TTL_SEC]:
+            del _compact_cache[uid]
+        for uid in [u for u, f in _recently_finished.items() if now - f[1] >= _RECENTLY_FINISHED_SEC]:
+            del _recently_finished[uid]
+        today = date.today()
+        for uid in [u for u, c in _stats_text_cache.items() if c[0][1] != today]:
+            del _stats_text_cache[uid]
+        for uid in [u for u, c in _streak_cache.items() if c[0][2] != today]:
+            del _streak_cache[uid]
+        try:
+            async with _acquire() as conn:
+                pruned = await conn.execute("DELETE FROM paused_sessions WHERE expires_at <= NOW()")
+            if stale or pruned != "DELETE 0":
+                print(f"[janitor] evicted {len(stale)} idle sessions, paused rows: {pruned}", flush=True)
+        except Exception as e:
+            await log_admin_event("ERROR", "session_janitor_error", f"Paused session prune failed: {e}")
+
+
 async def post_init(app):
     # Delete any stale webhook so polling can start without a Conflict right away.
     await app.bot.delete_webhook(drop_pending_updates=True)
     await init_db()
     await log_admin_event("INFO", "startup", "Bot started and DB initialized")
     asyncio.create_task(daily_quiz_reminder(app))
+    asyncio.create_task(result_writer(app))
+    asyncio.create_task(session_janitor())
+    if QUIZ_PREFETCH_ENABLED:
+        asyncio.create_task(quiz_prefetcher())
     await app.bot.set_my_commands([
         BotCommand("start",    "Главное меню"),
         BotCommand("quiz",     "Начать квиз"),
@@ -1909,8 +2424,32 @@ async def post_init(app):
         BotCommand("about",    "О Greekly"),
     ])
 
+async def post_shutdown(app):
+    # Results are persisted off the reply path; give queued writes a chance to
+    # land before the pool goes away so a restart does not drop finished quizzes.
+    try:
+        await asyncio.wait_for(_save_queue.join(), timeout=10)
+    except asyncio.TimeoutError:
+        print(f"[shutdown] {_save_queue.qsize()} quiz results still queued", flush=True)
+    await close_openai_client()
+    if db_pool is not None:
+        await db_pool.close()
+
 def main():
-    app = Application.builder().token(TG_TOKEN).post_init(post_init).build()
+    # Handlers await slow network work (quiz generation takes up to a minute); process
+    # updates concurrently so one user's /quiz does not stall everyone else's buttons.
+    app = (
+        Application.builder()
+        .token(TG_TOKEN)
+        .concurrent_updates(True)
+        # A burst of button taps can momentarily use every pooled connection; wait for a
+        # free one a little longer than PTB's 1s default instead of failing the call.
+        .connection_pool_size(TELEGRAM_POOL_SIZE)
+        .pool_timeout(TELEGRAM_POOL_TIMEOUT_SEC)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start",    start))
     app.add_handler(CommandHandler("quiz",     quiz_command))
     app.add_handler(CommandHandler("stats",    stats_command))
@@ -16,10 +16,24 @@ DATABASE_URL = require_env("DATABASE_URL").replace("postgres://", "postgresql://
 OPENAI_KEY = require_env("OPENAI_API_KEY")
 
 OPENAI_REQUEST_TIMEOUT_SEC = float(os.environ.get("OPENAI_REQUEST_TIMEOUT_SEC", "45"))
+OPENAI_CONNECT_TIMEOUT_SEC = float(os.environ.get("OPENAI_CONNECT_TIMEOUT_SEC", "5"))
 QUIZ_GENERATION_TIMEOUT_SEC = float(os.environ.get("QUIZ_GENERATION_TIMEOUT_SEC", "120"))
 OPENAI_MAX_ATTEMPTS = int(os.environ.get("OPENAI_MAX_ATTEMPTS", "3"))
 OPENAI_TEMPERATURE = float(os.environ.get("OPENAI_TEMPERATURE", "0.55"))
+# Extended prompt-cache retention (e.g. "24h"), opt-in: not every model supports it.
+# Empty (default) keeps OpenAI's in-memory TTL.
+OPENAI_PROMPT_CACHE_RETENTION = os.environ.get("OPENAI_PROMPT_CACHE_RETENTION", "")
 PAUSED_SESSION_TTL_HOURS = int(os.environ.get("PAUSED_SESSION_TTL_HOURS", "24"))
+MAX_IN_MEMORY_SESSIONS = int(os.environ.get("MAX_IN_MEMORY_SESSIONS", "10000"))
+COMPACT_DATA_CACHE_TTL_SEC = int(os.environ.get("COMPACT_DATA_CACHE_TTL_SEC", "300"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+# Outgoing Bot API connections (answers, edits, messages) share one HTTPX pool.
+TELEGRAM_POOL_SIZE = int(os.environ.get("TELEGRAM_POOL_SIZE", "256"))
+TELEGRAM_POOL_TIMEOUT_SEC = float(os.environ.get("TELEGRAM_POOL_TIMEOUT_SEC", "5"))
+# Overnight pre-generation of the next quiz for recently active users.
+QUIZ_PREFETCH_ENABLED = os.environ.get("QUIZ_PREFETCH_ENABLED", "1").lower() in ("1", "true", "yes")
+QUIZ_PREFETCH_LOCAL_HOUR = int(os.environ.get("QUIZ_PREFETCH_LOCAL_HOUR", "4"))
+QUIZ_PREFETCH_ACTIVE_DAYS = int(os.environ.get("QUIZ_PREFETCH_ACTIVE_DAYS", "3"))
 
 QUIZ_QUESTION_COUNT = 20
 
@@ -1,32 +1,38 @@
+import hashlib
 import json
 import random
 import time
 import traceback
 import unicodedata
-from datetime import date, datetime
+from datetime import date
+from operator import itemgetter
 
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, BadRequestError
 
 from config import (
+    OPENAI_CONNECT_TIMEOUT_SEC,
     OPENAI_KEY,
     OPENAI_MAX_ATTEMPTS,
+    OPENAI_PROMPT_CACHE_RETENTION,
     OPENAI_REQUEST_TIMEOUT_SEC,
     OPENAI_TEMPERATURE,
     QUIZ_GENERATION_TIMEOUT_SEC,
+    QUIZ_QUESTION_COUNT,
 )
-from topics import MASTER_TOPICS, normalize_topic
+from topics import MASTER_TOPICS, MASTER_TOPICS_SET, normalize_topic
 
 
-def days_since_last_session(session_dates):
+def days_since_last_session(session_dates, today: date | None = None):
     if not session_dates:
         return 99
-    return (date.today() - date.fromisoformat(session_dates[-1])).days
+    return ((today or date.today()) - date.fromisoformat(session_dates[-1])).days
 
 PROMPT_STATIC = """КРИТИЧЕСКИ ВАЖНО:
 - Только стандартный современный греческий язык (νέα ελληνική γλώσσα).
 - Никакого кипрского диалекта, кипрских слов, кипрского произношения.
 - Ученик не использует греческую клавиатуру. Все вопросы только с вариантами ответа, без ввода текста.
-- КАЖДЫЙ вопрос обязан быть встроен в мини-ситуацию из жизни ученика. Используй данные профиля выше (город, работу, хобби, семью, интересы) для создания персональных ситуаций. Текст вопроса начинай с короткого сценария (1-2 предложения), потом задавай языковую задачу.
+- КАЖДЫЙ вопрос обязан быть встроен в мини-ситуацию из жизни ученика. Используй данные профиля ученика из начала пользовательского сообщения (город, работу, хобби, семью, интересы) для создания персональных ситуаций. Текст вопроса начинай с короткого сценария (1-2 предложения), потом задавай языковую задачу.
   Плохо: «Как сказать по-гречески: "31 декабря"?»
   Хорошо: «Ты договариваешься с коллегой о корпоративе. Как сказать: "Вечеринка будет 31 декабря"?»
   Плохо: «Вставь артикль: ___ γυναίκα είναι όμορφη.»
@@ -161,7 +167,7 @@ PROMPT_STATIC = """КРИТИЧЕСКИ ВАЖНО:
 
 
 def build_profile_section(profile: dict) -> str:
-    """Build the personal section of the system prompt from user profile data."""
+    """Build the personal section of the user prompt from user profile data."""
     name = profile.get("display_name") or "Ученик"
     age = profile.get("age")
     city = profile.get("city") or "?"
@@ -195,15 +201,86 @@ def build_profile_section(profile: dict) -> str:
     )
 
 
-def build_system_prompt(profile: dict) -> str:
-    """Combine intro + personal profile + static quiz rules into the full system prompt."""
-    profile_section = build_profile_section(profile)
-    return (
-        "Ты генератор вопросов для квиза по греческому языку уровня A2.\n\n"
-        + profile_section
-        + "\n\n"
-        + PROMPT_STATIC
-    )
+# Identical for every user and every call: OpenAI caches prompt prefixes automatically,
+# so nothing user-specific may appear here — the profile goes into the user message.
+STATIC_SYSTEM_PROMPT = (
+    "Ты генератор вопросов для квиза по греческому языку уровня A2.\n\n"
+    + PROMPT_STATIC
+)
+
+
+def _prompt_cache_key(profile_section: str) -> str:
+    """Routing hint for OpenAI's prompt cache.
+
+    Requests with the same key land on the same cache shard, so a user's repeat
+    generations (and the repair calls in between) hit the cached system prompt +
+    profile prefix instead of competing with every other user's traffic.
+    """
+    return "quiz-" + hashlib.blake2b(profile_section.encode(), digest_size=8).hexdigest()
+
+
+_cache_retention_rejected = False  # set once the API refuses prompt_cache_retention
+
+
+def _cache_extra_body(profile_section: str) -> dict:
+    """Prompt-cache parameters sent with every generation / repair request.
+
+    The default in-memory cache lives for minutes, but most users open one quiz a
+    day, so the system prompt + profile prefix would almost always be cold.
+    Extended retention (OPENAI_PROMPT_CACHE_RETENTION, opt-in) keeps it for a day.
+    """
+    body = {"prompt_cache_key": _prompt_cache_key(profile_section)}
+    if OPENAI_PROMPT_CACHE_RETENTION and not _cache_retention_rejected:
+        body["prompt_cache_retention"] = OPENAI_PROMPT_CACHE_RETENTION
+    return body
+
+
+async def _create_completion(client, **kwargs):
+    """client.chat.completions.create, resent once without prompt_cache_retention on a 400.
+
+    If the retry goes through, the model does not support extended retention: the
+    parameter is dropped for the rest of the process instead of failing every quiz.
+    """
+    global _cache_retention_rejected
+    try:
+        return await client.chat.completions.create(**kwargs)
+    except BadRequestError as e:
+        extra_body = kwargs.get("extra_body") or {}
+        if "prompt_cache_retention" not in extra_body:
+            raise
+        print(f"[openai] request rejected (400), retrying without prompt_cache_retention: {e}", flush=True)
+        kwargs["extra_body"] = {k: v for k, v in extra_body.items() if k != "prompt_cache_retention"}
+        response = await client.chat.completions.create(**kwargs)
+        _cache_retention_rejected = True
+        print("[openai] prompt_cache_retention disabled for this process", flush=True)
+        return response
+
+
+# Invariant pieces of the per-request prompt, built once at import.
+VARIETY_HINTS = (
+    "фокус на бытовые диалоги и быстрые реплики",
+    "фокус на мини-истории с неожиданной деталью",
+    "фокус на вежливые просьбы и уточняющие вопросы",
+    "фокус на живые разговоры с эмоциями",
+    "фокус на практические ситуации из повседневной рутины",
+)
+
+REVIEW_NOTE = (
+    "ВАЖНО: ученик не занимался более 2 дней. "
+    "Первые 8 вопросов строго из уже пройденного материала (повторение). "
+    "Только после них переходи к новому.\n"
+)
+
+PRE_EXAM_NOTE = (
+    "ПРЕДЭКЗАМЕНАЦИОННЫЙ РЕЖИМ: из 20 вопросов ровно 6 должны быть в формате "
+    "короткий текст или диалог на греческом (3-5 строк) + вопрос на понимание прочитанного. "
+    "Эти 6 вопросов входят в общий лимит 20, не сверх него.\n"
+)
+
+TOPIC_PLAN_HEADER = (
+    "\n\nСЕРВЕРНЫЙ ПЛАН ТЕМ (ОБЯЗАТЕЛЬНО):\n"
+    "Для вопроса i (от 1 до 20) поле topic должно быть РОВНО как в строке i ниже.\n"
+)
 
 
 def build_dynamic_prompt(stats, session_dates, profile, required_topics=None):
@@ -219,33 +296,35 @@ def build_dynamic_prompt(stats, session_dates, profile, required_topics=None):
     learning_days = len(session_dates)
     is_learning = learning_days < 3
 
-    days_away = days_since_last_session(session_dates)
-    today = datetime.now().strftime("%Y-%m-%d")
+    today = date.today()
+    days_away = days_since_last_session(session_dates, today)
 
     # Seen topics sorted weakest-first, with recency indicator
+    # (unseen topics are listed separately below). Accuracy is computed once per topic;
+    # the C-level itemgetter key keeps the sort stable without a Python callback.
+    seen = [(s["correct"] / s["total"], topic, s) for topic, s in stats.items() if s["total"]]
+    seen.sort(key=itemgetter(0))
     hist_lines = []
-    for topic, s in sorted(stats.items(),
-                           key=lambda x: x[1]["correct"] / max(x[1]["total"], 1)):
-        if s["total"] == 0:
-            continue  # listed separately below as unseen
-        pct = round(s["correct"] / s["total"] * 100)
+    for accuracy, topic, s in seen:
+        pct = round(accuracy * 100)
         bar = "🔴" if pct < 60 else "🟡" if pct < 85 else "🟢"
         recency = ""
         if s.get("last_seen"):
-            ds = (datetime.strptime(today, "%Y-%m-%d") -
-                  datetime.strptime(s["last_seen"], "%Y-%m-%d")).days
+            ds = (today - date.fromisoformat(s["last_seen"])).days
             recency = f", {ds}д назад" if ds > 0 else ", сегодня"
         hist_lines.append(f"  {bar} {topic}: {pct}% ({s['total']} вопр.{recency})")
 
-    hist_summary = "\n".join(hist_lines) if hist_lines else "  (история пуста — первая сессия)"
+    if not hist_lines:
+        hist_lines.append("  (история пуста — первая сессия)")
 
     # Unseen topics — explicitly listed so the model knows exactly what hasn't been practiced
-    unseen = [t for t in MASTER_TOPICS if t not in stats or stats[t]["total"] == 0]
+    # The practiced set falls out of the `seen` list above; one hash probe per topic.
+    practiced = {topic for _, topic, _ in seen}
+    unseen = [t for t in MASTER_TOPICS if t not in practiced]
     if unseen:
-        hist_summary += (
-            f"\n\n⚪ Темы без практики ({len(unseen)} шт.) — вводи по 2-4 за квиз:\n"
-            + "\n".join(f"  ⚪ {t}" for t in unseen)
-        )
+        hist_lines.append(f"\n⚪ Темы без практики ({len(unseen)} шт.) — вводи по 2-4 за квиз:")
+        hist_lines.extend(f"  ⚪ {t}" for t in unseen)
+    hist_summary = "\n".join(hist_lines)
 
     learning_note = ""
     if is_learning:
@@ -256,67 +335,61 @@ def build_dynamic_prompt(stats, session_dates, profile, required_topics=None):
             f"Цель — собрать базовую статистику по максимуму тем.\n"
         )
 
-    review_note = ""
-    if not is_learning and days_away >= 2:
-        review_note = (
-            "ВАЖНО: ученик не занимался более 2 дней. "
-            "Первые 8 вопросов строго из уже пройденного материала (повторение). "
-            "Только после них переходи к новому.\n"
-        )
+    review_note = REVIEW_NOTE if not is_learning and days_away >= 2 else ""
 
     exam_date_obj = profile.get("exam_date") if profile else None
     exam_line = ""
     pre_exam_note = ""
     if exam_date_obj:
         if isinstance(exam_date_obj, date):
-            days_left = max((exam_date_obj - date.today()).days, 0)
+            days_left = max((exam_date_obj - today).days, 0)
         else:
             days_left = 0
         if days_left > 0:
             exam_line = f"До экзамена: {days_left} дней.\n"
             if days_left <= 30:
-                pre_exam_note = (
-                    "ПРЕДЭКЗАМЕНАЦИОННЫЙ РЕЖИМ: из 20 вопросов ровно 6 должны быть в формате "
-                    "короткий текст или диалог на греческом (3-5 строк) + вопрос на понимание прочитанного. "
-                    "Эти 6 вопросов входят в общий лимит 20, не сверх него.\n"
-                )
+                pre_exam_note = PRE_EXAM_NOTE
 
-    variety_hint = random.choice([
-        "фокус на бытовые диалоги и быстрые реплики",
-        "фокус на мини-истории с неожиданной деталью",
-        "фокус на вежливые просьбы и уточняющие вопросы",
-        "фокус на живые разговоры с эмоциями",
-        "фокус на практические ситуации из повседневной рутины",
-    ])
+    variety_hint = random.choice(VARIETY_HINTS)
 
     topic_plan_block = ""
     if required_topics:
         numbered = "\n".join(f"  {i+1}. {topic}" for i, topic in enumerate(required_topics))
-        topic_plan_block = (
-            "\n\nСЕРВЕРНЫЙ ПЛАН ТЕМ (ОБЯЗАТЕЛЬНО):\n"
-            "Для вопроса i (от 1 до 20) поле topic должно быть РОВНО как в строке i ниже.\n"
-            f"{numbered}\n"
-        )
+        topic_plan_block = f"{TOPIC_PLAN_HEADER}{numbered}\n"
 
+    # Ordered from most to least stable so the cached prefix reaches as far as
+    # possible: the random variety hint changes on every call and goes last.
     return (
         f"{exam_line}"
         f"{learning_note}"
         f"{review_note}"
         f"{pre_exam_note}"
-        f"Вариативный фокус этого квиза: {variety_hint}. Используй его как стиль, не нарушая приоритет тем.\n"
         f"Статистика ученика по темам (накопленная за всё время):\n"
         f"{hist_summary}"
         f"{topic_plan_block}"
+        f"\nВариативный фокус этого квиза: {variety_hint}. Используй его как стиль, не нарушая приоритет тем.\n"
     )
 
 
+_JSON_DECODER = json.JSONDecoder()
+
+
 def _extract_questions(raw: str, provider_name: str, expected_count: int = 20) -> list:
     """Parse AI JSON and return questions array with exact expected_count."""
-    raw = raw.replace("```json", "").replace("```", "").strip()
     try:
+        # Strict json_schema output is bare JSON — parse it as is.
         parsed = json.loads(raw)
-    except (ValueError, json.JSONDecodeError) as e:
-        raise ValueError(f"Не удалось распарсить ответ {provider_name}: {e}\nСырой ответ: {raw[:300]}")
+    except ValueError:
+        # Fallback for fenced/prefixed replies: decode in place from the first JSON
+        # bracket; raw_decode stops at the end of the value, so trailing ``` fences
+        # or prose need no stripping and the text is never sliced or copied.
+        start = min((i for i in (raw.find("{"), raw.find("[")) if i != -1), default=-1)
+        try:
+            if start == -1:
+                raise ValueError("JSON не найден")
+            parsed, _ = _JSON_DECODER.raw_decode(raw, start)
+        except ValueError as e:
+            raise ValueError(f"Не удалось распарсить ответ {provider_name}: {e}\nСырой ответ: {raw[:300]}")
 
     if isinstance(parsed, list):
         questions = parsed
@@ -341,6 +414,33 @@ TYPE_LABELS = {
     "fill_blank":  "✏️ Заполни пропуск",
 }
 
+_QUESTION_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["question", "options", "correctIndex", "explanation", "topic", "type"],
+    "properties": {
+        "question": {"type": "string"},
+        "options": {
+            "type": "array",
+            "minItems": 4,
+            "maxItems": 4,
+            "items": {"type": "string"},
+        },
+        "correctIndex": {"type": "integer", "minimum": 0, "maximum": 3},
+        "explanation": {"type": "string"},
+        "topic": {"type": "string", "enum": MASTER_TOPICS},
+        "type": {"type": "string", "enum": list(TYPE_LABELS.keys())},
+    },
+}
+
+# Identifies the generation recipe (system prompt + question schema). Stored quiz
+# sets are only reused while it matches, so a deploy that changes either
+# invalidates them.
+PROMPT_DIGEST = hashlib.blake2b(
+    (STATIC_SYSTEM_PROMPT + json.dumps(_QUESTION_SCHEMA, sort_keys=True, ensure_ascii=False)).encode(),
+    digest_size=8,
+).hexdigest()
+
 TYPE_NAMES_RU = {
     "ru_to_gr":    "Перевод RU→GR",
     "gr_to_ru":    "Перевод GR→RU",
@@ -388,7 +488,7 @@ def _collect_question_errors(questions: list) -> dict:
         if q["type"] not in TYPE_LABELS:
             errors[i] = f"недопустимый type={q['type']!r}"
             continue
-        if q.get("topic") not in MASTER_TOPICS:
+        if q.get("topic") not in MASTER_TOPICS_SET:
             errors[i] = f"недопустимый topic={q.get('topic')!r}"
             continue
         opts = q.get("options")
@@ -436,6 +536,20 @@ def _collect_topic_plan_errors(questions: list, required_topics: list[str] | Non
             errors[i] = f"topic должен быть '{expected}', получено '{actual}'"
     return errors
 
+def shuffle_options(questions: list) -> list:
+    """Permute each question's options in place, keeping correctIndex on the right answer.
+
+    The new correctIndex comes from the permutation itself rather than a search
+    for the correct option's text.
+    """
+    for q in questions:
+        opts = q["options"]
+        perm = random.sample(range(len(opts)), len(opts))
+        q["options"] = [opts[i] for i in perm]
+        q["correctIndex"] = perm.index(q["correctIndex"])
+    return questions
+
+
 def _finalize_questions(questions: list) -> list:
     """Normalize topics, enforce validity and shuffle options server-side."""
     # Normalise topic names FIRST — guard against mixed Greek/Cyrillic characters
@@ -449,16 +563,46 @@ def _finalize_questions(questions: list) -> list:
         first_i = min(errors)
         raise ValueError(f"Question {first_i}: {errors[first_i]}")
 
-    # Server-side shuffle — correct answer is never stuck at position 0
-    for q in questions:
-        correct_text = q["options"][q["correctIndex"]]
-        random.shuffle(q["options"])
-        q["correctIndex"] = q["options"].index(correct_text)
-
-    return questions
+    # Server-side shuffle — correct answer is never stuck at position 0.
+    return shuffle_options(questions)
+
+
+# Completion budget scales with the number of questions requested: a full quiz
+# needs ~3.5-4k output tokens, while a repair batch of a few slots needs a
+# fraction of that (and a fixed cap truncated large repair batches).
+_TOKENS_PER_QUESTION = 210
+_TOKENS_OVERHEAD = 300
+
+
+def _max_output_tokens(n: int) -> int:
+    return _TOKENS_OVERHEAD + _TOKENS_PER_QUESTION * n
+
+
+def _quiz_response_format(name: str, n: int) -> dict:
+    """Strict JSON schema for exactly n questions — the model cannot emit prose or fences."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["questions"],
+                "properties": {
+                    "questions": {
+                        "type": "array",
+                        "minItems": n,
+                        "maxItems": n,
+                        "items": _QUESTION_SCHEMA,
+                    },
+                },
+            },
+        },
+    }
 
 
-async def _repair_questions_openai(client, system_prompt: str, questions: list, invalid: dict) -> list:
+async def _repair_questions_openai(client, profile_section: str, questions: list, invalid: dict) -> list:
     """Regenerate only invalid question slots and return same-length replacement list."""
     bad_payload = [
         {
@@ -470,6 +614,7 @@ async def _repair_questions_openai(client, system_prompt: str, questions: list,
     ]
     n = len(bad_payload)
     repair_prompt = (
+        f"{profile_section}\n\n"
         f"Сгенерируй {n} СОВЕРШЕННО НОВЫХ вопросов взамен проблемных. "
         "Верни ТОЛЬКО JSON-объект с полем questions, "
         f"в котором ровно {n} новых вопросов в том же порядке, что и список ниже.\n\n"
@@ -485,49 +630,15 @@ async def _repair_questions_openai(client, system_prompt: str, questions: list,
         f"{json.dumps(bad_payload, ensure_ascii=False)}"
     )
 
-    response = await client.chat.completions.create(
+    response = await _create_completion(
+        client,
         model="gpt-4.1-mini",
-        max_tokens=1800,
+        max_tokens=_max_output_tokens(n),
         temperature=OPENAI_TEMPERATURE,
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "quiz_question_repairs",
-                "strict": True,
-                "schema": {
-                    "type": "object",
-                    "additionalProperties": False,
-                    "required": ["questions"],
-                    "properties": {
-                        "questions": {
-                            "type": "array",
-                            "minItems": n,
-                            "maxItems": n,
-                            "items": {
-                                "type": "object",
-                                "additionalProperties": False,
-                                "required": ["question", "options", "correctIndex", "explanation", "topic", "type"],
-                                "properties": {
-                                    "question": {"type": "string"},
-                                    "options": {
-                                        "type": "array",
-                                        "minItems": 4,
-                                        "maxItems": 4,
-                                        "items": {"type": "string"},
-                                    },
-                                    "correctIndex": {"type": "integer", "minimum": 0, "maximum": 3},
-                                    "explanation": {"type": "string"},
-                                    "topic": {"type": "string", "enum": MASTER_TOPICS},
-                                    "type": {"type": "string", "enum": list(TYPE_LABELS.keys())},
-                                },
-                            },
-                        },
-                    },
-                },
-            },
-        },
+        response_format=_quiz_response_format("quiz_question_repairs", n),
+        extra_body=_cache_extra_body(profile_section),
         messages=[
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": STATIC_SYSTEM_PROMPT},
             {"role": "user", "content": repair_prompt},
         ],
     )
@@ -535,81 +646,150 @@ async def _repair_questions_openai(client, system_prompt: str, questions: list,
     return _extract_questions(raw, "gpt-4.1-mini repair", expected_count=n)
 
 
-async def _generate_questions_openai(stats, session_dates, profile, required_topics=None):
-    client = AsyncOpenAI(api_key=OPENAI_KEY, timeout=OPENAI_REQUEST_TIMEOUT_SEC)
-    system_prompt = build_system_prompt(profile or {})
+_openai_client = None
+
+
+def _get_openai_client() -> AsyncOpenAI:
+    """Return the process-wide OpenAI client so its connection pool and TLS sessions are reused."""
+    global _openai_client
+    if _openai_client is None:
+        print("[openai] creating async client …", flush=True)
+        # A short connect timeout fails fast on a dead route so the SDK's own retry
+        # kicks in, instead of burning the whole read budget on a TCP handshake.
+        _openai_client = AsyncOpenAI(
+            api_key=OPENAI_KEY,
+            timeout=httpx.Timeout(OPENAI_REQUEST_TIMEOUT_SEC, connect=OPENAI_CONNECT_TIMEOUT_SEC),
+        )
+    return _openai_client
+
+
+async def close_openai_client() -> None:
+    """Close the shared client's connection pool (called on bot shutdown)."""
+    global _openai_client
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+
+
+class _QuestionCounter:
+    """Count question objects completed so far in a streamed {"questions": [{...}, ...]} reply.
+
+    A minimal JSON scanner: tracks nesting depth outside string literals, and every
+    "}" that closes back to the array level finishes one question.
+    """
+
+    __slots__ = ("depth", "in_string", "escaped", "done")
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.done = 0
+
+    def feed(self, text: str) -> int:
+        for ch in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if ch == "}" and self.depth == 2:
+                    self.done += 1
+        return self.done
+
+
+async def _stream_completion(client, t0: float, on_progress=None, **kwargs):
+    """Run a streamed chat completion and return (content, finish_reason, usage).
+
+    Streaming keeps the connection busy with small chunks instead of one long
+    silent wait, so the read timeout applies per chunk rather than to the whole
+    ~20-question generation, and time-to-first-token becomes visible in logs.
+    on_progress, if given, is called (synchronously) with the number of question
+    objects received so far each time that number grows.
+    """
+    counter = _QuestionCounter() if on_progress else None
+    stream = await _create_completion(
+        client,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs,
+    )
+    parts = []
+    finish = None
+    usage = None
+    async for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta.content:
+            if not parts:
+                print(f"[openai] first token after {time.monotonic() - t0:.1f}s", flush=True)
+            parts.append(choice.delta.content)
+            if counter is not None:
+                before = counter.done
+                if counter.feed(choice.delta.content) > before:
+                    on_progress(counter.done)
+        if choice.finish_reason:
+            finish = choice.finish_reason
+    return "".join(parts).strip(), finish, usage
+
+
+async def _generate_questions_openai(stats, session_dates, profile, required_topics=None, on_progress=None):
+    client = _get_openai_client()
+    profile_section = build_profile_section(profile or {})
     dynamic_prompt = build_dynamic_prompt(stats, session_dates, profile or {}, required_topics=required_topics)
     max_attempts = OPENAI_MAX_ATTEMPTS
     retry_hint = ""
     last_error = None
 
-    print("[openai] creating async client …", flush=True)
     for attempt in range(1, max_attempts + 1):
         t0 = time.monotonic()
-        user_prompt = f"{dynamic_prompt}{retry_hint}"
+        user_prompt = f"{profile_section}\n\n{dynamic_prompt}{retry_hint}"
         print(
             f"[openai] sending request to gpt-4.1-mini (attempt {attempt}/{max_attempts}, prompt ~{len(user_prompt)} chars) …",
             flush=True,
         )
-        response = await client.chat.completions.create(
+        raw, finish, usage = await _stream_completion(
+            client,
+            t0,
+            on_progress,
             model="gpt-4.1-mini",
-            max_tokens=4500,
+            max_tokens=_max_output_tokens(QUIZ_QUESTION_COUNT),
             temperature=OPENAI_TEMPERATURE,
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "quiz_questions",
-                    "strict": True,
-                    "schema": {
-                        "type": "object",
-                        "additionalProperties": False,
-                        "required": ["questions"],
-                        "properties": {
-                            "questions": {
-                                "type": "array",
-                                "minItems": 20,
-                                "maxItems": 20,
-                                "items": {
-                                    "type": "object",
-                                    "additionalProperties": False,
-                                    "required": ["question", "options", "correctIndex", "explanation", "topic", "type"],
-                                    "properties": {
-                                        "question": {"type": "string"},
-                                        "options": {
-                                            "type": "array",
-                                            "minItems": 4,
-                                            "maxItems": 4,
-                                            "items": {"type": "string"},
-                                        },
-                                        "correctIndex": {"type": "integer", "minimum": 0, "maximum": 3},
-                                        "explanation": {"type": "string"},
-                                        "topic": {"type": "string", "enum": MASTER_TOPICS},
-                                        "type": {"type": "string", "enum": list(TYPE_LABELS.keys())},
-                                    },
-                                },
-                            },
-                        },
-                    },
-                },
-            },
+            response_format=_quiz_response_format("quiz_questions", QUIZ_QUESTION_COUNT),
+            extra_body=_cache_extra_body(profile_section),
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": STATIC_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt},
             ],
         )
         elapsed = time.monotonic() - t0
         print(f"[openai] response received in {elapsed:.1f}s", flush=True)
-        choice = response.choices[0]
-        finish = choice.finish_reason
-        raw = (choice.message.content or "").strip()
         print(f"[openai] finish_reason={finish!r}, content length={len(raw)} chars", flush=True)
+        if usage is not None:
+            cached = usage.prompt_tokens_details.cached_tokens if usage.prompt_tokens_details else None
+            print(
+                f"[openai] prompt tokens={usage.prompt_tokens}, cached={cached}, "
+                f"completion tokens={usage.completion_tokens}",
+                flush=True,
+            )
         if finish == "length":
             raise ValueError("gpt-4.1-mini обрезал ответ по лимиту токенов (finish_reason='length').")
         if not raw:
             last_error = ValueError(f"gpt-4.1-mini вернул пустой ответ (finish_reason={finish!r})")
         else:
             try:
-                parsed = _extract_questions(raw, "gpt-4.1-mini")
+                parsed = _extract_questions(raw, "gpt-4.1-mini", expected_count=QUIZ_QUESTION_COUNT)
 
                 # Fast path: repair only broken question slots instead of full-regenerating all 20.
                 for repair_round in range(1, 3):
@@ -620,7 +800,7 @@ async def _generate_questions_openai(stats, session_dates, profile, required_top
                         f"[openai] attempting targeted repair round {repair_round}: {len(errors)} invalid question(s)",
                         flush=True,
                     )
-                    repaired = await _repair_questions_openai(client, system_prompt, parsed, errors)
+                    repaired = await _repair_questions_openai(client, profile_section, parsed, errors)
                     for repl, idx in zip(repaired, sorted(errors)):
                         parsed[idx] = repl
 
@@ -632,7 +812,7 @@ async def _generate_questions_openai(stats, session_dates, profile, required_top
                         f"[openai] enforcing server topic plan, repair round {repair_round}: {len(topic_plan_errors)} slot(s)",
                         flush=True,
                     )
-                    repaired = await _repair_questions_openai(client, system_prompt, parsed, topic_plan_errors)
+                    repaired = await _repair_questions_openai(client, profile_section, parsed, topic_plan_errors)
                     for repl, idx in zip(repaired, sorted(topic_plan_errors)):
                         parsed[idx] = repl
                     topic_plan_errors = _collect_topic_plan_errors(parsed, required_topics)
@@ -668,5 +848,7 @@ async def _generate_questions_openai(stats, session_dates, profile, required_top
     raise ValueError(f"Не удалось сгенерировать валидный квиз за {max_attempts} попытки. Последняя ошибка: {last_error}")
 
 
-async def generate_questions(stats, session_dates, profile, required_topics=None):
-    return await _generate_questions_openai(stats, session_dates, profile, required_topics=required_topics)
+async def generate_questions(stats, session_dates, profile, required_topics=None, on_progress=None):
+    return await _generate_questions_openai(
+        stats, session_dates, profile, required_topics=required_topics, on_progress=on_progress,
+    )
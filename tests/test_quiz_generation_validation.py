@@ -1,5 +1,10 @@
+import asyncio
 import importlib
 import sys
+import types
+
+import httpx
+import openai
 
 
 def _load_quiz_generation(monkeypatch):
@@ -29,3 +34,113 @@ def test_collect_question_errors_detects_duplicates_without_name_error(monkeypat
 
     assert 0 in errors
     assert "duplicate options detected" in errors[0]
+
+
+def test_extract_questions_handles_fenced_reply(monkeypatch):
+    quiz_generation = _load_quiz_generation(monkeypatch)
+
+    raw = 'Вот вопросы:\n```json\n{"questions": [{"question": "a"}, {"question": "b"}]}\n```'
+
+    questions = quiz_generation._extract_questions(raw, "OpenAI", expected_count=2)
+
+    assert [q["question"] for q in questions] == ["a", "b"]
+
+
+def test_finalize_questions_shuffle_keeps_correct_answer(monkeypatch):
+    quiz_generation = _load_quiz_generation(monkeypatch)
+
+    questions = [
+        {
+            "question": "q",
+            "options": ["Ναι", "Όχι", "Ίσως", "Ποτέ"],
+            "correctIndex": 2,
+            "explanation": "e",
+            "topic": "Глаголы",
+            "type": "ru_to_gr",
+        }
+        for _ in range(20)
+    ]
+
+    finalized = quiz_generation._finalize_questions(questions)
+
+    for q in finalized:
+        assert sorted(q["options"]) == sorted(["Ναι", "Όχι", "Ίσως", "Ποτέ"])
+        assert q["options"][q["correctIndex"]] == "Ίσως"
+
+
+def test_question_counter_tracks_streamed_objects(monkeypatch):
+    quiz_generation = _load_quiz_generation(monkeypatch)
+
+    raw = '{"questions": [{"question": "a {b} \\"[\\"", "options": ["x}"]}, {"question": "c"}]}'
+    counter = quiz_generation._QuestionCounter()
+    progress = [counter.feed(raw[i:i + 5]) for i in range(0, len(raw), 5)]
+
+    assert progress[-1] == 2
+    assert progress == sorted(progress)
+
+
+def test_shuffle_options_reshuffles_a_stored_set(monkeypatch):
+    quiz_generation = _load_quiz_generation(monkeypatch)
+
+    options = ["Ναι", "Όχι", "Ίσως", "Ποτέ"]
+    questions = [
+        {
+            "question": "q",
+            "options": list(options),
+            "correctIndex": 0,
+            "explanation": "e",
+            "topic": "Глаголы",
+            "type": "ru_to_gr",
+        }
+        for _ in range(20)
+    ]
+
+    shuffled = quiz_generation.shuffle_options(questions)
+
+    assert any(q["correctIndex"] != 0 for q in shuffled)
+    for q in shuffled:
+        assert sorted(q["options"]) == sorted(options)
+        assert q["options"][q["correctIndex"]] == "Ναι"
+
+
+def test_prompt_cache_retention_is_opt_in(monkeypatch):
+    monkeypatch.delenv("OPENAI_PROMPT_CACHE_RETENTION", raising=False)
+    quiz_generation = _load_quiz_generation(monkeypatch)
+
+    body = quiz_generation._cache_extra_body("profile")
+
+    assert "prompt_cache_key" in body
+    assert "prompt_cache_retention" not in body
+
+
+def test_rejected_prompt_cache_retention_is_dropped(monkeypatch):
+    monkeypatch.setenv("OPENAI_PROMPT_CACHE_RETENTION", "24h")
+    quiz_generation = _load_quiz_generation(monkeypatch)
+
+    calls = []
+
+    class _Completions:
+        async def create(self, **kwargs):
+            calls.append(kwargs["extra_body"])
+            if "prompt_cache_retention" in kwargs["extra_body"]:
+                request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+                raise openai.BadRequestError(
+                    "Unrecognized request argument supplied: prompt_cache_retention",
+                    response=httpx.Response(400, request=request),
+                    body=None,
+                )
+            return "ok"
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_Completions()))
+
+    async def _two_requests():
+        first = await quiz_generation._create_completion(
+            client, extra_body=quiz_generation._cache_extra_body("profile"),
+        )
+        second = await quiz_generation._create_completion(
+            client, extra_body=quiz_generation._cache_extra_body("profile"),
+        )
+        return first, second
+
+    assert asyncio.run(_two_requests()) == ("ok", "ok")
+    assert [("prompt_cache_retention" in body) for body in calls] == [True, False, False]
@@ -1,4 +1,5 @@
 import difflib
+import functools
 from datetime import date
 
 
@@ -26,10 +27,17 @@ MASTER_TOPICS = [
     "Наречия",
 ]
 
+MASTER_TOPICS_SET = frozenset(MASTER_TOPICS)
 
+
+@functools.lru_cache(maxsize=256)
 def normalize_topic(topic: str) -> str:
-    """Map API-returned topic to the nearest canonical MASTER_TOPICS name."""
-    if topic in MASTER_TOPICS:
+    """Map API-returned topic to the nearest canonical MASTER_TOPICS name.
+
+    Memoized: the model repeats the same few spellings, so difflib runs at most
+    once per distinct variant.
+    """
+    if topic in MASTER_TOPICS_SET:
         return topic
     matches = difflib.get_close_matches(topic, MASTER_TOPICS, n=1, cutoff=0.6)
     return matches[0] if matches else topic
@@ -83,11 +91,17 @@ def build_topic_sequence(
             return 999
         return (today - last).days
 
+    # Pools only ever hold MASTER_TOPICS: compute each per-topic signal once
+    # instead of re-parsing ISO dates inside every sort key.
+    acc_by = {t: acc(t) for t in MASTER_TOPICS}
+    last_seen_by = {t: last_seen_days(t) for t in MASTER_TOPICS}
+
     seen_topics = {t for t, s in stats.items() if s.get("total", 0) > 0}
     unseen_topics = [t for t in MASTER_TOPICS if t not in seen_topics]
-    weak_topics = [t for t in MASTER_TOPICS if t in seen_topics and acc(t) < 0.60]
-    medium_topics = [t for t in MASTER_TOPICS if t in seen_topics and 0.60 <= acc(t) < 0.85]
-    strong_topics = [t for t in MASTER_TOPICS if t in seen_topics and acc(t) >= 0.85]
+    unseen_set = set(unseen_topics)
+    weak_topics = [t for t in MASTER_TOPICS if t in seen_topics and acc_by[t] < 0.60]
+    medium_topics = [t for t in MASTER_TOPICS if t in seen_topics and 0.60 <= acc_by[t] < 0.85]
+    strong_topics = [t for t in MASTER_TOPICS if t in seen_topics and acc_by[t] >= 0.85]
 
     def memory(topic: str) -> dict:
         return topic_memory.get(topic) or {}
@@ -108,8 +122,8 @@ def build_topic_sequence(
 
     def priority(topic: str) -> float:
         overdue_signal = min(overdue_days(topic) / 14.0, 1.5)
-        recency_signal = min(last_seen_days(topic) / 14.0, 1.5)
-        novelty_signal = 0.25 if topic in unseen_topics else 0.0
+        recency_signal = min(last_seen_by[topic] / 14.0, 1.5)
+        novelty_signal = 0.25 if topic in unseen_set else 0.0
 
         return (
             0.45 * overdue_signal
@@ -119,13 +133,15 @@ def build_topic_sequence(
             + novelty_signal
         )
 
+    priority_by = {t: priority(t) for t in MASTER_TOPICS}
+
     def sort_pool(pool: list[str], weakest_first: bool) -> list[str]:
         return sorted(
             pool,
             key=lambda t: (
-                -priority(t),
-                acc(t) if weakest_first else -acc(t),
-                -last_seen_days(t),
+                -priority_by[t],
+                acc_by[t] if weakest_first else -acc_by[t],
+                -last_seen_by[t],
             ),
         )
 
@@ -151,7 +167,7 @@ def build_topic_sequence(
 
     if learning_mode:
         fill_from_pool(unseen_topics, min(5, total_questions), weakest_first=True)
-        fill_from_pool([t for t in MASTER_TOPICS if t not in unseen_topics],
+        fill_from_pool([t for t in MASTER_TOPICS if t not in unseen_set],
                        total_questions - len(sequence), weakest_first=True)
     else:
         quotas = {